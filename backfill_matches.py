@@ -0,0 +1,297 @@
+from pymongo import UpdateOne, ASCENDING
+
+import os
+import json
+import argparse
+import asyncio
+import time
+from collections import deque
+from bson import ObjectId
+from dotenv import load_dotenv
+
+from utils.db import mongo_db, get_player_key
+from utils.http import api_client
+from utils.ratelimit import rate_limiter, BACKGROUND
+from utils.parser import decode_match
+
+# Downloads the v4 match again for every Match_Data document saved without who_won (saved by old versions
+# of the bot) and writes the full document back.
+# The region of a match comes from a player we know played it: the owner of an rr history entry for the
+# match, or else a tracked player in its match_players. Matches with no known player are skipped unless
+# --probe-regions is given, which tries every region and costs up to one request per region.
+# Progress is checkpointed after every bulk write, so a crashed or stopped run continues where it left
+# off. Requests go through the same rate limiter as the bot, so the run is paced by the API quota.
+# Matches that are still rate limited after the client's retries are queued again once the main pass is
+# done, and left for the next run (the checkpoint stays before them) if another pass doesn't get them.
+
+load_dotenv()
+API_KEY = os.getenv('VAL_API_KEY_2')
+uri = os.getenv('MONGODB_URI')
+HENRIK_RATE_LIMIT = int(os.getenv('HENRIK_RATE_LIMIT', 30))
+HENRIK_RATE_PERIOD = float(os.getenv('HENRIK_RATE_PERIOD', 60))
+CHECKPOINT_PATH = os.getenv('BACKFILL_CHECKPOINT_PATH', 'data/backfill_checkpoint.json')
+headers = {
+    "Accept": "application/json",
+    "Authorization": f"{API_KEY}"
+}
+
+REGIONS = ['na', 'eu', 'ap', 'kr', 'latam', 'br']
+# who_won is missing, null or NaN (documents written from a pandas dataframe), the seed row is left alone
+MISSING_QUERY = {'match_id': {'$nin': ['', None]}, 'who_won': {'$in': [None, float('nan')]}}
+PROJECTION = {'match_id': 1, 'match_players.name': 1, 'match_players.tag': 1}
+
+def load_checkpoint(path: str) -> dict:
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'last_id': None, 'repaired': 0, 'failed': {}}
+
+def save_checkpoint(path: str, checkpoint: dict):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(temp_path, path)
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+# match_id -> region for the matches we know a player of
+async def get_regions(mongo: mongo_db, documents: list) -> dict:
+    players = mongo.client['players'].Players
+    rr_history = mongo.client['players'].comp_rr_history
+
+    region_by_puuid = {}
+    regions = {}
+    match_ids = [match_data['match_id'] for match_data in documents]
+    history = await mongo.run(lambda: list(rr_history.find({'match_id': {'$in': match_ids}}, {'_id': 0, 'match_id': 1, 'puuid': 1})))
+    if history:
+        puuids = list({entry['puuid'] for entry in history})
+        for player_doc in await mongo.run(lambda: list(players.find({'puuid': {'$in': puuids}}, {'_id': 0, 'puuid': 1, 'region': 1}))):
+            if player_doc.get('region'):
+                region_by_puuid[player_doc['puuid']] = player_doc['region'].lower()
+        for entry in history:
+            if entry['puuid'] in region_by_puuid:
+                regions.setdefault(entry['match_id'], region_by_puuid[entry['puuid']])
+
+    unknown = [match_data for match_data in documents if match_data['match_id'] not in regions]
+    player_keys = list({get_player_key(f'{player_data.get("name")}#{player_data.get("tag")}') for match_data in unknown for player_data in match_data.get('match_players') or []})
+    if player_keys:
+        region_by_key = {}
+        for player_doc in await mongo.run(lambda: list(players.find({'player_key': {'$in': player_keys}}, {'_id': 0, 'player_key': 1, 'region': 1}))):
+            if player_doc.get('region'):
+                region_by_key[player_doc['player_key']] = player_doc['region'].lower()
+        for match_data in unknown:
+            for player_data in match_data.get('match_players') or []:
+                region = region_by_key.get(get_player_key(f'{player_data.get("name")}#{player_data.get("tag")}'))
+                if region != None:
+                    regions[match_data['match_id']] = region
+                    break
+    return regions
+
+class backfill():
+    def __init__(self, mongo: mongo_db, http: api_client, checkpoint_path: str, checkpoint: dict, workers: int, batch_size: int, probe_regions: bool):
+        self.mongo = mongo
+        self.http = http
+        self.collection = mongo.client['matches'].Match_Data
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.batch_size = batch_size
+        self.probe_regions = probe_regions
+        # _ids in the order they were handed out, the checkpoint only moves past an _id once it and
+        # every _id before it is written (or failed), so nothing is skipped when resuming
+        self.order = deque()
+        self.done = set()
+        self.operations = []
+        self.finished_ids = []
+        # (object_id, match_id, region) of matches the API still answered with 429, tried again after the pass
+        self.rate_limited = []
+        self.flush_lock = asyncio.Lock()
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self.reported_at = 0
+
+    async def run(self):
+        query = dict(MISSING_QUERY)
+        if self.checkpoint['last_id'] != None:
+            query['_id'] = {'$gt': ObjectId(self.checkpoint['last_id'])}
+        self.total = await self.mongo.run(self.collection.count_documents, query)
+        print(f'[Backfill] {self.total} matches to repair, {self.checkpoint["repaired"]} repaired by earlier runs')
+
+        await self.process(lambda queue: self.produce(queue, query))
+        # the limiter is blocked until the API's Retry-After is over, so the retry pass waits for it
+        while self.rate_limited:
+            items, self.rate_limited = self.rate_limited, []
+            print(f'[Backfill] retrying {len(items)} rate limited matches')
+            await self.process(lambda queue: self.put_all(queue, items))
+            if len(self.rate_limited) == len(items):
+                break
+        await self.flush()
+        self.report(force=True)
+
+    # runs the workers until produce(queue) has queued everything and the queue is worked off. if the
+    # producer or a worker raises, the others are cancelled and the error is raised here, otherwise the
+    # producer would wait forever on a full queue nobody takes from
+    async def process(self, produce):
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+
+        async def feed():
+            await produce(queue)
+            for _ in range(self.workers):
+                await queue.put(None)
+
+        tasks = [asyncio.create_task(feed())] + [asyncio.create_task(self.worker(queue)) for _ in range(self.workers)]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() != None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # one short query per chunk instead of one cursor, a cursor would time out while the chunk waits on the API
+    async def produce(self, queue: asyncio.Queue, query: dict):
+        while True:
+            documents = await self.mongo.run(lambda: list(self.collection.find(query, PROJECTION).sort('_id', ASCENDING).limit(self.batch_size)))
+            if not documents:
+                break
+            regions = await get_regions(self.mongo, documents)
+            for match_data in documents:
+                self.order.append(match_data['_id'])
+                await queue.put((match_data['_id'], match_data['match_id'], regions.get(match_data['match_id'])))
+            query['_id'] = {'$gt': documents[-1]['_id']}
+
+    async def put_all(self, queue: asyncio.Queue, items: list):
+        for item in items:
+            await queue.put(item)
+
+    async def worker(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item == None:
+                return
+            object_id, match_id, region = item
+            await self.repair(object_id, match_id, region)
+            if len(self.finished_ids) >= self.batch_size:
+                await self.flush()
+            self.report()
+
+    async def repair(self, object_id: ObjectId, match_id: str, region: str):
+        regions = [region] if region != None else (REGIONS if self.probe_regions else [])
+        if not regions:
+            self.fail(object_id, match_id, 'unknown region')
+            return
+
+        status = None
+        for region in regions:
+            try:
+                status, raw = await self.http.get_bytes(f'https://api.henrikdev.xyz/valorant/v4/match/{region}/{match_id}', headers=headers, priority=BACKGROUND)
+            except Exception as e:
+                self.fail(object_id, match_id, f'{type(e).__name__}: {e}')
+                return
+            if status == 200:
+                # old matches are the most likely to come back in a shape the parser doesn't expect
+                try:
+                    match_document = decode_match(raw)
+                except Exception as e:
+                    self.fail(object_id, match_id, f'invalid match: {type(e).__name__}: {e}')
+                    return
+                self.operations.append(UpdateOne({'_id': object_id}, {'$set': match_document}))
+                self.finished_ids.append(object_id)
+                self.completed += 1
+                return
+            # the match is not in this region, try the next one
+            if status != 404:
+                break
+        if status == 429:
+            # not done, so the checkpoint can't move past it until it is repaired
+            self.rate_limited.append((object_id, match_id, region if len(regions) == 1 else None))
+            return
+        self.fail(object_id, match_id, f'status {status}')
+
+    def fail(self, object_id: ObjectId, match_id: str, reason: str):
+        self.checkpoint['failed'][match_id] = reason
+        self.finished_ids.append(object_id)
+        self.completed += 1
+        self.failed += 1
+
+    async def flush(self):
+        async with self.flush_lock:
+            operations, finished_ids = self.operations, self.finished_ids
+            self.operations, self.finished_ids = [], []
+            if operations:
+                await self.mongo.run(self.collection.bulk_write, operations, ordered=False)
+                self.checkpoint['repaired'] += len(operations)
+
+            self.done.update(finished_ids)
+            while self.order and self.order[0] in self.done:
+                object_id = self.order.popleft()
+                self.done.discard(object_id)
+                self.checkpoint['last_id'] = str(object_id)
+            await asyncio.to_thread(save_checkpoint, self.checkpoint_path, self.checkpoint)
+
+    def report(self, force: bool = False):
+        now = time.time()
+        if not force and now - self.reported_at < 10:
+            return
+        self.reported_at = now
+        elapsed = now - self.started_at
+        rate = self.completed / elapsed if elapsed > 0 else 0
+        eta = format_duration((self.total - self.completed) / rate) if rate > 0 else '?'
+        print(f'[Backfill] ({self.completed}/{self.total}) {self.completed - self.failed} repaired, {self.failed} failed | {rate * 60:.1f} matches/min | elapsed {format_duration(elapsed)} | eta {eta}')
+
+async def count_regions(mongo: mongo_db, batch_size: int):
+    collection = mongo.client['matches'].Match_Data
+    query = dict(MISSING_QUERY)
+    total, known = 0, 0
+    while True:
+        documents = await mongo.run(lambda: list(collection.find(query, PROJECTION).sort('_id', ASCENDING).limit(batch_size)))
+        if not documents:
+            break
+        total += len(documents)
+        known += len(await get_regions(mongo, documents))
+        query['_id'] = {'$gt': documents[-1]['_id']}
+    print(f'[Backfill] {total} matches are missing who_won, the region of {known} is known ({total - known} need --probe-regions)')
+
+async def main():
+    parser = argparse.ArgumentParser(description='Download Match_Data documents that are missing who_won again')
+    parser.add_argument('--workers', type=int, default=4, help='matches downloaded at the same time')
+    parser.add_argument('--batch-size', type=int, default=100, help='matches per bulk write and checkpoint')
+    parser.add_argument('--rate', type=int, default=HENRIK_RATE_LIMIT, help=f'requests allowed per {HENRIK_RATE_PERIOD:g}s by the API key')
+    parser.add_argument('--probe-regions', action='store_true', help='try every region for matches with no known player')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH, help='checkpoint file')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and scan from the start (retries failed matches)')
+    parser.add_argument('--dry-run', action='store_true', help='count the matches to repair without downloading anything')
+    args = parser.parse_args()
+
+    mongo = mongo_db(uri)
+    if args.dry_run:
+        await count_regions(mongo, args.batch_size)
+        mongo.close()
+        return
+
+    rr_history = mongo.client['players'].comp_rr_history
+    await mongo.run(rr_history.create_index, 'match_id')
+
+    checkpoint = load_checkpoint(args.checkpoint) if not args.restart else {'last_id': None, 'repaired': 0, 'failed': {}}
+    http = api_client(limiters={'api.henrikdev.xyz': rate_limiter(args.rate, per=HENRIK_RATE_PERIOD)})
+    job = backfill(mongo, http, args.checkpoint, checkpoint, args.workers, args.batch_size, args.probe_regions)
+    try:
+        await job.run()
+    finally:
+        await http.close()
+        mongo.close()
+
+    if job.rate_limited:
+        print(f'[Backfill] {len(job.rate_limited)} matches were still rate limited, run again later to repair them')
+    if checkpoint['failed']:
+        print(f'[Backfill] {len(checkpoint["failed"])} matches could not be repaired, see {args.checkpoint} (run with --restart to retry them)')
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from utils import parser
+from utils.parser import decode_match
+from utils.models import match_player
+from benchmarks.payloads import make_match_bytes
+
+# compares how comp_history read a v4 match before the shared decoder (json.loads the whole body,
+# build match_player objects, then the Match_Data dict from them) against decode_match,
+# run with: python -m benchmarks.bench_parser
+
+# the parsing the cog did before decode_match, kept here as the baseline
+def baseline_parse(raw: bytes) -> dict:
+    data = json.loads(raw)['data']
+    metadata = data['metadata']
+    players = data['players']
+    teams = data['teams']
+
+    match_players = []
+    blue_score = 0
+    red_score = 0
+    who_won = None
+    match_start_time = datetime.strptime(metadata['started_at'], "%Y-%m-%dT%H:%M:%S.%fZ")
+    match_finish_time = match_start_time + timedelta(milliseconds=int(metadata['game_length_in_ms']))
+
+    for player_index in range(len(players)):
+        player_data = players[player_index]
+        player_stats = player_data['stats']
+        ability_casts = player_data['ability_casts']
+        match_players.append(match_player(player_data['name'], player_data['tag'], player_data['team_id'], player_data['agent']['name'].lower(), player_stats['kills'], player_stats['deaths'], player_stats['score'], player_stats['assists'], player_stats['headshots'], player_stats['bodyshots'], player_stats['legshots'], ability_casts['grenade'], ability_casts['ability1'], ability_casts['ability2'], ability_casts['ultimate'], player_data['tier']['name']))
+
+    for team_index in range(len(teams)):
+        team_data = teams[team_index]
+        if team_data['team_id'] == 'Red':
+            red_score = team_data['rounds']['won']
+            if team_data['won'] == True:
+                who_won = 'Red'
+        elif team_data['team_id'] == 'Blue':
+            blue_score = team_data['rounds']['won']
+            if team_data['won'] == True:
+                who_won = 'Blue'
+    if who_won == None:
+        who_won = 'Tie'
+
+    player_data_list = []
+    for p in match_players:
+        player_data_list.append({
+            "name": p.player_name,
+            "tag": p.player_tag,
+            "team_id": p.team_id,
+            "agent": p.agent_name,
+            "kills": p.kills,
+            "deaths": p.deaths,
+            "score": p.score,
+            "assists": p.assists,
+            "headshots": p.headshots,
+            "bodyshots": p.bodyshots,
+            "legshots": p.legshots,
+            "ability_casts": {
+                "grenade": p.e_ability,
+                "ability1": p.c_ability,
+                "ability2": p.q_ability,
+                "ultimate": p.x_ability
+            },
+            "tier": p.rank_in_match
+        })
+
+    return {
+        "map_name": metadata['map']['name'],
+        "server": metadata['cluster'],
+        "match_id": metadata['match_id'],
+        "blue_score": blue_score,
+        "red_score": red_score,
+        "who_won": who_won,
+        "match_players": player_data_list,
+        "start_date": match_start_time,
+        "end_date": match_finish_time
+    }
+
+# a payload with null in every field the api may leave empty must decode the same with msgspec and json
+def check_nullable_fields():
+    payload = json.loads(make_match_bytes(0))
+    data = payload['data']
+    data['metadata']['match_id'] = None
+    data['metadata']['cluster'] = None
+    data['metadata']['map']['name'] = None
+    data['teams'][0]['team_id'] = None
+    data['teams'][1]['won'] = None
+    for field in ['name', 'tag', 'team_id']:
+        data['players'][0][field] = None
+    data['players'][0]['tier']['name'] = None
+    data['players'][0]['ability_casts']['ultimate'] = None
+    raw = json.dumps(payload).encode()
+    assert decode_match(raw) == parser.decode_match_json(raw), 'decoders disagree on null fields'
+
+def time_it(func, payloads: list, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for raw in payloads:
+            func(raw)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return best / len(payloads)
+
+def main():
+    argparser = argparse.ArgumentParser(description='Benchmark v4 match payload decoding')
+    argparser.add_argument('--matches', type=int, default=50, help='distinct payloads to decode')
+    argparser.add_argument('--repeat', type=int, default=5, help='runs, the best one is reported')
+    args = argparser.parse_args()
+
+    payloads = [make_match_bytes(seed) for seed in range(args.matches)]
+    for raw in payloads:
+        match_data = decode_match(raw)
+        del match_data['schema_version']
+        assert baseline_parse(raw) == match_data, 'decoders disagree'
+    check_nullable_fields()
+
+    backend = 'msgspec' if parser.msgspec != None else ('orjson' if parser.loads is not json.loads else 'json (fallback)')
+    average_size = sum(len(raw) for raw in payloads) / len(payloads)
+    print(f'{len(payloads)} payloads, {average_size / 1024:.0f} KiB on average, decode_match backend: {backend}')
+
+    old_time = time_it(baseline_parse, payloads, args.repeat)
+    new_time = time_it(decode_match, payloads, args.repeat)
+    print(f'baseline parse: {old_time * 1000:.3f} ms/match')
+    print(f'decode_match:   {new_time * 1000:.3f} ms/match ({old_time / new_time:.1f}x)')
+
+if __name__ == '__main__':
+    main()
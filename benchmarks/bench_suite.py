@@ -0,0 +1,176 @@
+import os
+import gc
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+from utils.parser import loads, decode_match, get_match_document, normalize_match_document
+from utils.models import iter_match_batches
+from utils.analytics import get_kill_ratios
+from utils import snapshot
+from cogs.val import val_player, get_rr_history_entry, get_parsed_match, get_player_match
+from benchmarks.recording import load_fixture
+from benchmarks.payloads import iter_match_documents, make_match_pool
+
+# time and peak memory of the code that runs on every command plus the Match_Data analytics,
+# all offline: the API responses come from benchmarks/fixtures and Match_Data is generated.
+#   python -m benchmarks.bench_suite                     run everything at 1k and 100k matches
+#   python -m benchmarks.bench_suite --scales 1000000    the 1M match analytics only take a few minutes
+#   python -m benchmarks.bench_suite --compare data/benchmarks/<commit>.json
+# results are saved to data/benchmarks/<commit>.json
+
+RESULTS_PATH = 'data/benchmarks'
+
+def get_commit() -> str:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# best and mean wall time over repeat runs, then one more run under tracemalloc for the peak memory
+# (kept out of the timed runs because tracing slows everything down)
+def measure(func, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': min(times), 'mean_seconds': sum(times) / len(times), 'peak_bytes': peak, 'runs': repeat}
+
+# operations on the recorded responses, one command's worth of work each
+def get_fixture_operations() -> dict:
+    account_raw = load_fixture('account')
+    mmr_history_raw = load_fixture('mmr_history')
+    match_raw = load_fixture('match')
+    match_document = decode_match(match_raw)
+    parsed_match = get_parsed_match(match_document)
+    lookup_player = f'{match_document["match_players"][0]["name"]}#{match_document["match_players"][0]["tag"]}'
+
+    def parse_account():
+        data = loads(account_raw)['data']
+        return val_player(data['puuid'], data['name'], data['tag'], data['region'], data['account_level'], data.get('title'), data.get('card'))
+
+    def parse_mmr_history():
+        history = [get_rr_history_entry(match) for match in loads(mmr_history_raw)['data']]
+        history.sort(key=lambda entry: entry['date'], reverse=True)
+        return history
+
+    return {
+        'account.parse': parse_account,
+        'mmr_history.parse': parse_mmr_history,
+        'match.decode_match': lambda: decode_match(match_raw),
+        'match.get_match_document': lambda: get_match_document(json.loads(match_raw)['data']),
+        'match.get_parsed_match': lambda: get_parsed_match(match_document),
+        'match.get_formatted_map': lambda: get_player_match(parsed_match, lookup_player).get_formatted_map()
+    }
+
+# operations over a whole generated Match_Data collection, streamed so 1M matches fit in memory.
+# the pool is generated here, outside measure(), so the timings and peak memory are only the
+# operation and cycling through the pool (which is what iterate measures on its own)
+def get_scale_operations(count: int) -> dict:
+    pool = make_match_pool(count)
+
+    def iterate():
+        for _ in iter_match_documents(count, pool):
+            pass
+
+    def build_batches():
+        for _ in iter_match_batches(iter_match_documents(count, pool)):
+            pass
+
+    def normalize():
+        for match_data in iter_match_documents(count, pool):
+            normalize_match_document(match_data)
+
+    def snapshot_columns():
+        chunk = []
+        for match_data in iter_match_documents(count, pool):
+            chunk.append(match_data)
+            if len(chunk) >= 5000:
+                snapshot.get_columns(chunk)
+                chunk = []
+        snapshot.get_columns(chunk)
+
+    operations = {
+        f'match_data[{count}].iterate': iterate,
+        f'match_data[{count}].build_match_batch': build_batches,
+        f'match_data[{count}].get_kill_ratios': lambda: get_kill_ratios(iter_match_documents(count, pool)),
+        f'match_data[{count}].normalize': normalize
+    }
+    if snapshot.pa != None:
+        operations[f'match_data[{count}].snapshot_columns'] = snapshot_columns
+    return operations
+
+def format_bytes(size: float) -> str:
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GiB'
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:.1f} us'
+    if seconds < 1:
+        return f'{seconds * 1e3:.2f} ms'
+    return f'{seconds:.2f} s'
+
+def print_results(results: dict, baseline: dict = None):
+    for name, result in results.items():
+        line = f'{name:<42} {format_seconds(result["seconds"]):>10} {format_bytes(result["peak_bytes"]):>11}'
+        if baseline != None and name in baseline:
+            line += f'   {result["seconds"] / baseline[name]["seconds"]:.2f}x time, {format_bytes(result["peak_bytes"] - baseline[name]["peak_bytes"])} memory'
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the command hot paths and the Match_Data analytics')
+    parser.add_argument('--scales', default='1000,100000', help='comma separated Match_Data sizes, e.g. 1000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs of each per command operation, the best one is reported')
+    parser.add_argument('--scale-repeat', type=int, default=1, help='timed runs of each Match_Data operation')
+    parser.add_argument('--filter', default=None, help='only run operations whose name contains this')
+    parser.add_argument('--output', default=None, help=f'results file (default {RESULTS_PATH}/<commit>.json)')
+    parser.add_argument('--compare', default=None, help='results file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    operations = [(name, func, args.repeat) for name, func in get_fixture_operations().items()]
+    for count in [int(scale) for scale in args.scales.split(',') if scale]:
+        operations += [(name, func, args.scale_repeat) for name, func in get_scale_operations(count).items()]
+    if args.filter != None:
+        operations = [operation for operation in operations if args.filter in operation[0]]
+
+    results = {}
+    for name, func, repeat in operations:
+        results[name] = measure(func, repeat)
+        print(f'[Bench] {name}: {format_seconds(results[name]["seconds"])}, peak {format_bytes(results[name]["peak_bytes"])}')
+
+    commit = get_commit()
+    output = args.output or os.path.join(RESULTS_PATH, f'{commit}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'commit': commit, 'created_at': datetime.now().isoformat(), 'python': platform.python_version(), 'results': results}, file, indent=2)
+
+    baseline = None
+    if args.compare != None:
+        with open(args.compare, 'r') as file:
+            baseline_run = json.load(file)
+        baseline = baseline_run['results']
+        print(f'\ncompared to {baseline_run["commit"]} ({baseline_run["created_at"]})')
+    print()
+    print_results(results, baseline)
+    print(f'\nsaved to {output}')
+
+if __name__ == '__main__':
+    main()
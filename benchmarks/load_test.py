@@ -0,0 +1,318 @@
+import io
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import threading
+import contextlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+from utils.db import mongo_db, get_player_key
+from utils.http import api_client
+from utils.ratelimit import rate_limiter
+from utils.metrics import metrics_registry
+from cogs.val import val
+from benchmarks.recording import load_fixture
+from benchmarks.payloads import make_mmr_history_payload
+
+# How many concurrent /val_stats and /comp_history commands one bot process handles, measured offline:
+#   - a fake HenrikDev API (aiohttp, on its own thread and event loop) with configurable latency and 429s
+#   - mongo in memory (mongomock) or a local throwaway mongod given with --mongo
+#   - fake interactions calling the val cog's commands directly, no discord connection
+# for every concurrency level the virtual users send commands back to back for --duration seconds, and
+# the latency percentiles, throughput and event loop lag of that level are reported.
+# after the warm-up every player is cached, so --cold-share sets the share of commands that first forget
+# their player (see forget_player) and go through the cold path: account, rr history and matches from the API
+#   python -m benchmarks.load_test --concurrency 1,10,50,100 --latency 0.08 --rate-limit-probability 0.01
+#   python -m benchmarks.load_test --concurrency 10,50 --cold-share 0.2
+
+HENRIK_URL = 'https://api.henrikdev.xyz'
+
+def get_puuid(player: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, get_player_key(player)))
+
+def get_percentile(values: list, percentile: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+# serves the three endpoints the cog calls, every player has a stable puuid, rr history and matches
+class fake_henrik_api():
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, rate_limit_probability: float = 0, retry_after: float = 1, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.match_raw = load_fixture('match')
+        self.fixture_match_id = json.loads(self.match_raw)['data']['metadata']['match_id'].encode()
+        self.histories = {}
+        self.requests = Counter()
+        self.rate_limited = 0
+        self.base_url = None
+        self.loop = None
+        self.runner = None
+
+    # run the server on its own thread, so serving requests doesn't add to the bot's event loop lag
+    def start(self) -> str:
+        ready = threading.Event()
+        thread = threading.Thread(target=self.serve, args=(ready,), daemon=True, name='fake-henrik-api')
+        thread.start()
+        ready.wait()
+        return self.base_url
+
+    def serve(self, ready: threading.Event):
+        self.loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_get('/valorant/v2/account/{name}/{tag}', self.get_account)
+        app.router.add_get('/valorant/v1/by-puuid/mmr-history/{region}/{puuid}', self.get_mmr_history)
+        app.router.add_get('/valorant/v4/match/{region}/{match_id}', self.get_match)
+        self.runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.base_url = f'http://127.0.0.1:{self.runner.addresses[0][1]}'
+        ready.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        if self.loop != None:
+            asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def respond(self, endpoint: str, get_body) -> web.Response:
+        self.requests[endpoint] += 1
+        await asyncio.sleep(max(0, self.rng.gauss(self.latency, self.jitter)))
+        if self.rng.random() < self.rate_limit_probability:
+            self.rate_limited += 1
+            return web.json_response({'status': 429, 'errors': [{'message': 'Rate limit exceeded'}]}, status=429, headers={'Retry-After': f'{self.retry_after:g}'})
+        return web.Response(body=get_body(), content_type='application/json')
+
+    async def get_account(self, request: web.Request) -> web.Response:
+        name, tag = request.match_info['name'], request.match_info['tag']
+        def get_body():
+            puuid = get_puuid(f'{name}#{tag}')
+            return json.dumps({'status': 200, 'data': {
+                'puuid': puuid,
+                'region': 'na',
+                'account_level': 100 + int(puuid[:2], 16),
+                'name': name,
+                'tag': tag,
+                'card': str(uuid.uuid5(uuid.NAMESPACE_URL, 'card' + puuid)),
+                'title': None,
+                'platforms': ['PC'],
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }}).encode()
+        return await self.respond('account', get_body)
+
+    async def get_mmr_history(self, request: web.Request) -> web.Response:
+        puuid = request.match_info['puuid']
+        def get_body():
+            if puuid not in self.histories:
+                self.histories[puuid] = json.dumps(make_mmr_history_payload(uuid.UUID(puuid).int % 2 ** 32)).encode()
+            return self.histories[puuid]
+        return await self.respond('mmr_history', get_body)
+
+    # the recorded match with the requested match id swapped in
+    async def get_match(self, request: web.Request) -> web.Response:
+        match_id = request.match_info['match_id'].encode()
+        return await self.respond('match', lambda: self.match_raw.replace(self.fixture_match_id, match_id))
+
+# api_client that sends the HenrikDev requests to the fake server instead
+class local_api_client(api_client):
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def get(self, url: str, **kwargs):
+        return super().get(url.replace(HENRIK_URL, self.base_url, 1), **kwargs)
+
+# mongo_db backed by mongomock. mongomock isn't thread safe, so it gets a single worker
+class memory_mongo_db(mongo_db):
+    def __init__(self):
+        import mongomock
+        self.client = mongomock.MongoClient()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mongo')
+        self.metrics = metrics_registry()
+
+class fake_response():
+    def __init__(self):
+        self.deferred = False
+
+    async def defer(self, *args, **kwargs):
+        self.deferred = True
+
+class fake_followup():
+    def __init__(self):
+        self.content = None
+        self.embed = None
+
+    async def send(self, content=None, embed=None, **kwargs):
+        self.content = content
+        self.embed = embed
+
+class fake_interaction():
+    def __init__(self):
+        self.response = fake_response()
+        self.followup = fake_followup()
+
+# how late the event loop wakes up from short sleeps, i.e. how long callbacks wait behind blocking work
+class loop_lag_monitor():
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0, time.perf_counter() - start - self.interval))
+
+class fake_client():
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+# drops everything the cog and mongo keep about a player except the Players document /comp_history
+# looks them up by, so their next command downloads the account, rr history and matches again
+async def forget_player(cog: val, mongo: mongo_db, player: str):
+    player_key = get_player_key(player)
+    puuid = get_puuid(player)
+    rr_history = mongo.client['players'].comp_rr_history
+    match_ids = await mongo.run(rr_history.distinct, 'match_id', {'puuid': puuid})
+    await mongo.run(rr_history.delete_many, {'puuid': puuid})
+    await mongo.run(mongo.client['matches'].Match_Data.delete_many, {'match_id': {'$in': match_ids}})
+    await mongo.run(mongo.client['players'].Players.update_one, {'player_key': player_key}, {'$unset': {'account_level': ''}})
+    cog.account_cache.delete(player_key)
+    cog.synced_history.delete(puuid)
+    for match_id in match_ids:
+        cog.parsed_matches.delete(match_id)
+        cog.rendered_matches.delete((match_id, player_key))
+
+async def run_command(cog: val, command: str, player: str) -> bool:
+    interaction = fake_interaction()
+    await getattr(cog, command).callback(cog, interaction, player)
+    return interaction.followup.embed != None
+
+async def run_level(cog: val, mongo: mongo_db, players: list, concurrency: int, duration: float, comp_history_share: float, cold_share: float) -> dict:
+    latencies = {'val_stats': [], 'comp_history': []}
+    errors = Counter()
+    cold_commands = 0
+    monitor = loop_lag_monitor()
+    monitor_task = asyncio.create_task(monitor.run())
+    deadline = time.perf_counter() + duration
+
+    async def user(index: int):
+        nonlocal cold_commands
+        rng = random.Random(index)
+        while time.perf_counter() < deadline:
+            command = 'comp_history' if rng.random() < comp_history_share else 'val_stats'
+            player = rng.choice(players)
+            # forgetting isn't part of the command, so it isn't timed
+            if rng.random() < cold_share:
+                await forget_player(cog, mongo, player)
+                cold_commands += 1
+            start = time.perf_counter()
+            try:
+                if not await run_command(cog, command, player):
+                    errors[f'{command}: no embed'] += 1
+            except Exception as e:
+                errors[f'{command}: {type(e).__name__}'] += 1
+            latencies[command].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[user(index) for index in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    monitor_task.cancel()
+
+    all_latencies = latencies['val_stats'] + latencies['comp_history']
+    result = {
+        'concurrency': concurrency,
+        'commands': len(all_latencies),
+        'cold_commands': cold_commands,
+        'throughput': len(all_latencies) / elapsed,
+        'errors': dict(errors),
+        'loop_lag_p99': get_percentile(monitor.samples, 99),
+        'loop_lag_max': max(monitor.samples, default=0)
+    }
+    for name, values in [('all', all_latencies)] + list(latencies.items()):
+        result[name] = {f'p{percentile}': get_percentile(values, percentile) for percentile in (50, 95, 99)}
+        result[name]['count'] = len(values)
+    return result
+
+def print_result(result: dict):
+    def ms(seconds: float) -> str:
+        return f'{seconds * 1000:.0f}ms'
+    latency = result['all']
+    print(f'[Load] c={result["concurrency"]:<4} {result["commands"]:>6} commands ({result["cold_commands"]} cold) {result["throughput"]:>8.1f}/s | p50 {ms(latency["p50"])} p95 {ms(latency["p95"])} p99 {ms(latency["p99"])} | loop lag p99 {ms(result["loop_lag_p99"])} max {ms(result["loop_lag_max"])} | errors {sum(result["errors"].values())}')
+    for command in ['val_stats', 'comp_history']:
+        latency = result[command]
+        if latency['count'] > 0:
+            print(f'         {command:<13} {latency["count"]:>6} | p50 {ms(latency["p50"])} p95 {ms(latency["p95"])} p99 {ms(latency["p99"])}')
+
+async def main():
+    parser = argparse.ArgumentParser(description='Load test the val cog against local stand-ins for discord, HenrikDev and mongo')
+    parser.add_argument('--concurrency', default='1,10,50,100', help='comma separated numbers of concurrent users')
+    parser.add_argument('--duration', type=float, default=20, help='seconds each concurrency level runs')
+    parser.add_argument('--players', type=int, default=200, help='distinct players the users look up')
+    parser.add_argument('--comp-history-share', type=float, default=0.5, help='share of commands that are /comp_history, the rest are /val_stats')
+    parser.add_argument('--latency', type=float, default=0.05, help='mean fake API latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02, help='standard deviation of the fake API latency')
+    parser.add_argument('--cold-share', type=float, default=0, help='share of commands whose player is forgotten first, so they miss every cache')
+    parser.add_argument('--rate-limit-probability', type=float, default=0, help='share of fake API responses that are 429s')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After seconds sent with the 429s')
+    parser.add_argument('--rate', type=int, default=100000, help='HenrikDev requests per minute the bot allows itself')
+    parser.add_argument('--mongo', default='memory', help='"memory" for mongomock, or the uri of a throwaway local mongod (its players and matches databases are written to)')
+    parser.add_argument('--scheduler', action='store_true', help='keep the background refresh scheduler running')
+    parser.add_argument('--verbose', action='store_true', help="show the cog's own output")
+    parser.add_argument('--output', default=None, help='also write the results to this json file')
+    args = parser.parse_args()
+
+    server = fake_henrik_api(args.latency, args.jitter, args.rate_limit_probability, args.retry_after)
+    base_url = server.start()
+    http = local_api_client(base_url, limiters={'api.henrikdev.xyz': rate_limiter(args.rate, per=60)})
+    mongo = memory_mongo_db() if args.mongo == 'memory' else mongo_db(args.mongo)
+
+    cog = val(fake_client(asyncio.get_running_loop()), mongo=mongo, http=http)
+    cog.catalog_task.cancel()
+    if not args.scheduler:
+        cog.scheduler_task.cancel()
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    players = [f'LoadPlayer{index}#{1000 + index % 9000}' for index in range(args.players)]
+    results = []
+    try:
+        with output:
+            # already scheduled by the cog
+            await cog.setup_task
+            # every player is looked up once first, /comp_history only works for players in the database
+            semaphore = asyncio.Semaphore(20)
+            async def warm_up(player: str):
+                async with semaphore:
+                    await run_command(cog, 'val_stats', player)
+            await asyncio.gather(*[warm_up(player) for player in players])
+
+        print(f'[Load] fake API at {base_url} ({args.latency * 1000:.0f}ms latency, {args.rate_limit_probability * 100:g}% 429s), mongo: {args.mongo}, {args.players} players')
+        for concurrency in [int(level) for level in args.concurrency.split(',') if level]:
+            with output:
+                result = await run_level(cog, mongo, players, concurrency, args.duration, args.comp_history_share, args.cold_share)
+            print_result(result)
+            results.append(result)
+    finally:
+        cog.cog_unload()
+        await http.close()
+        server.stop()
+
+    print(f'[Load] fake API served {sum(server.requests.values())} requests ({dict(server.requests)}), {server.rate_limited} were 429s')
+    if args.output != None:
+        with open(args.output, 'w') as file:
+            json.dump({'args': vars(args), 'levels': results, 'api_requests': dict(server.requests), 'api_rate_limited': server.rate_limited}, file, indent=2)
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,232 @@
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from utils.parser import SCHEMA_VERSION
+
+# synthetic HenrikDev payloads shaped like the real responses, including the large parts
+# (rounds and kill events) that the bot never stores, so decoding costs are realistic
+
+AGENTS = ['Astra', 'Breach', 'Brimstone', 'Chamber', 'Clove', 'Cypher', 'Deadlock', 'Fade', 'Gekko', 'Harbor', 'Iso', 'Jett', 'KAY/O', 'Killjoy', 'Neon', 'Omen', 'Phoenix', 'Raze', 'Reyna', 'Sage', 'Skye', 'Sova', 'Viper', 'Vyse', 'Yoru']
+MAPS = ['Ascent', 'Bind', 'Haven', 'Split', 'Lotus', 'Sunset', 'Abyss', 'Icebox', 'Breeze', 'Pearl']
+SERVERS = ['US East', 'US West', 'US Central', 'Frankfurt', 'Stockholm', 'London', 'Tokyo']
+TIERS = ['Iron 3', 'Bronze 2', 'Silver 1', 'Gold 3', 'Platinum 2', 'Diamond 1', 'Ascendant 2', 'Immortal 1']
+
+def make_player(rng: random.Random, index: int, team_id: str, rounds: int) -> dict:
+    kills = rng.randint(3, 35)
+    return {
+        'puuid': str(uuid.UUID(int=rng.getrandbits(128))),
+        'name': f'Player{index}',
+        'tag': f'{rng.randint(1000, 9999)}',
+        'team_id': team_id,
+        'platform': 'pc',
+        'party_id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'agent': {'id': str(uuid.UUID(int=rng.getrandbits(128))), 'name': rng.choice(AGENTS)},
+        'stats': {
+            'score': rng.randint(80, 350) * rounds,
+            'kills': kills,
+            'deaths': rng.randint(5, 25),
+            'assists': rng.randint(0, 15),
+            'headshots': rng.randint(5, 40),
+            'bodyshots': rng.randint(20, 120),
+            'legshots': rng.randint(0, 20),
+            'damage': {'dealt': rng.randint(1000, 5000), 'received': rng.randint(1000, 5000)}
+        },
+        'ability_casts': {
+            'grenade': rng.choice([None, rng.randint(0, 20)]),
+            'ability1': rng.randint(0, 30),
+            'ability2': rng.randint(0, 30),
+            'ultimate': rng.randint(0, 5)
+        },
+        'tier': {'id': rng.randint(3, 27), 'name': rng.choice(TIERS)},
+        'card_id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'title_id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'prefered_level_border': None,
+        'account_level': rng.randint(20, 500),
+        'session_playtime_in_ms': rng.randint(1000000, 3000000),
+        'behavior': {'afk_rounds': 0, 'friendly_fire': {'incoming': 0, 'outgoing': 0}, 'rounds_in_spawn': 0},
+        'economy': {'spent': {'overall': rng.randint(50000, 100000), 'average': 3500}, 'loadout_value': {'overall': 80000, 'average': 3800}}
+    }
+
+def make_round(rng: random.Random, round_index: int, players: list) -> dict:
+    return {
+        'id': round_index,
+        'result': rng.choice(['Elimination', 'Bomb detonated', 'Bomb defused']),
+        'ceremony': 'CeremonyDefault',
+        'winning_team': rng.choice(['Blue', 'Red']),
+        'plant': None,
+        'defuse': None,
+        'stats': [{
+            'player': {'puuid': player['puuid'], 'name': player['name'], 'tag': player['tag'], 'team': player['team_id']},
+            'ability_casts': {'grenade': 1, 'ability_1': 0, 'ability_2': 1, 'ultimate': 0},
+            'damage_events': [{'puuid': rng.choice(players)['puuid'], 'damage': rng.randint(10, 150), 'headshots': 1, 'bodyshots': 1, 'legshots': 0} for _ in range(2)],
+            'stats': {'score': rng.randint(0, 600), 'kills': rng.randint(0, 3), 'headshots': 1, 'bodyshots': 2, 'legshots': 0},
+            'economy': {'loadout_value': 3900, 'remaining': 200, 'weapon': {'id': 'vandal', 'name': 'Vandal', 'type': 'Weapon'}, 'armor': {'id': 'heavy', 'name': 'Heavy Shields'}},
+            'was_afk': False,
+            'received_penalty': False,
+            'stayed_in_spawn': False
+        } for player in players]
+    }
+
+def make_kill(rng: random.Random, players: list, round_index: int) -> dict:
+    killer, victim = rng.sample(players, 2)
+    return {
+        'time_in_round_in_ms': rng.randint(1000, 100000),
+        'time_in_match_in_ms': rng.randint(1000, 3000000),
+        'round': round_index,
+        'killer': {'puuid': killer['puuid'], 'name': killer['name'], 'tag': killer['tag'], 'team': killer['team_id']},
+        'victim': {'puuid': victim['puuid'], 'name': victim['name'], 'tag': victim['tag'], 'team': victim['team_id']},
+        'assistants': [],
+        'location': {'x': rng.randint(-5000, 5000), 'y': rng.randint(-5000, 5000)},
+        'weapon': {'id': 'vandal', 'name': 'Vandal', 'type': 'Weapon'},
+        'secondary_fire_mode': False,
+        'player_locations': [{'player': {'puuid': player['puuid'], 'team': player['team_id']}, 'view_radians': 1.5, 'location': {'x': 0, 'y': 0}} for player in players]
+    }
+
+# a v4 /match/{region}/{match_id} response
+def make_match_payload(seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    blue_rounds = rng.randint(0, 13)
+    red_rounds = 13 if blue_rounds < 12 else blue_rounds + 2
+    if rng.random() < 0.5:
+        blue_rounds, red_rounds = red_rounds, blue_rounds
+    rounds = blue_rounds + red_rounds
+    players = [make_player(rng, index, 'Blue' if index < 5 else 'Red', rounds) for index in range(10)]
+    started_at = datetime(2024, 11, 1) + timedelta(seconds=rng.randint(0, 30 * 24 * 60 * 60))
+    return {
+        'status': 200,
+        'data': {
+            'metadata': {
+                'match_id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'map': {'id': str(uuid.UUID(int=rng.getrandbits(128))), 'name': rng.choice(MAPS)},
+                'game_version': 'release-09.09-shipping-19-2924789',
+                'game_length_in_ms': rng.randint(1500000, 3000000),
+                'started_at': started_at.strftime('%Y-%m-%dT%H:%M:%S.') + f'{rng.randint(0, 999):03d}Z',
+                'is_completed': True,
+                'queue': {'id': 'competitive', 'name': 'Competitive', 'mode_type': 'Standard'},
+                'season': {'id': str(uuid.UUID(int=rng.getrandbits(128))), 'short': 'e9a3'},
+                'platform': 'pc',
+                'premier': None,
+                'party_rr_penaltys': [],
+                'region': 'na',
+                'cluster': rng.choice(SERVERS)
+            },
+            'players': players,
+            'observers': [],
+            'coaches': [],
+            'teams': [
+                {'team_id': 'Blue', 'rounds': {'won': blue_rounds, 'lost': red_rounds}, 'won': blue_rounds > red_rounds, 'premier_roster': None},
+                {'team_id': 'Red', 'rounds': {'won': red_rounds, 'lost': blue_rounds}, 'won': red_rounds > blue_rounds, 'premier_roster': None}
+            ],
+            'rounds': [make_round(rng, round_index, players) for round_index in range(rounds)],
+            'kills': [make_kill(rng, players, round_index) for round_index in range(rounds) for _ in range(rng.randint(5, 9))]
+        }
+    }
+
+def make_match_bytes(seed: int = 0) -> bytes:
+    return json.dumps(make_match_payload(seed)).encode()
+
+# a v2 /account/{name}/{tag} response
+def make_account_payload(seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {
+        'status': 200,
+        'data': {
+            'puuid': str(uuid.UUID(int=rng.getrandbits(128))),
+            'region': 'na',
+            'account_level': rng.randint(20, 500),
+            'name': f'Player{seed}',
+            'tag': f'{rng.randint(1000, 9999)}',
+            'card': str(uuid.UUID(int=rng.getrandbits(128))),
+            'title': str(uuid.UUID(int=rng.getrandbits(128))),
+            'platforms': ['PC'],
+            'updated_at': '2024-11-02T21:33:49.123Z'
+        }
+    }
+
+# a v1 /by-puuid/mmr-history/{region}/{puuid} response, newest game first
+def make_mmr_history_payload(seed: int = 0, games: int = 20) -> dict:
+    rng = random.Random(seed)
+    date_raw = int(datetime(2024, 12, 1).timestamp())
+    data = []
+    for _ in range(games):
+        date_raw -= rng.randint(30 * 60, 2 * 24 * 60 * 60)
+        tier = rng.randint(3, 27)
+        data.append({
+            'currenttier': tier,
+            'currenttierpatched': rng.choice(TIERS),
+            'images': {
+                'small': f'https://media.valorant-api.com/competitivetiers/03621f52-342b-cf4e-4f86-9350a49c6d04/{tier}/smallicon.png',
+                'large': f'https://media.valorant-api.com/competitivetiers/03621f52-342b-cf4e-4f86-9350a49c6d04/{tier}/largeicon.png',
+                'triangle_down': f'https://media.valorant-api.com/competitivetiers/03621f52-342b-cf4e-4f86-9350a49c6d04/{tier}/ranktriangledownicon.png',
+                'triangle_up': f'https://media.valorant-api.com/competitivetiers/03621f52-342b-cf4e-4f86-9350a49c6d04/{tier}/ranktriangleupicon.png'
+            },
+            'match_id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'map': {'name': rng.choice(MAPS), 'id': str(uuid.UUID(int=rng.getrandbits(128)))},
+            'season_id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'ranking_in_tier': rng.randint(0, 99),
+            'mmr_change_to_last_game': rng.randint(-30, 30),
+            'elo': tier * 100 + rng.randint(0, 99),
+            'date': datetime.fromtimestamp(date_raw).strftime('%A, %B %d, %Y %I:%M %p'),
+            'date_raw': date_raw
+        })
+    return {'status': 200, 'name': f'Player{seed}', 'tag': '0000', 'data': data}
+
+# a stored Match_Data document, legacy ones look like what old versions of the bot saved
+# (ability casts as a string, no who_won, no schema version)
+def make_match_document(seed: int = 0, legacy: bool = False) -> dict:
+    rng = random.Random(seed)
+    blue_score = rng.randint(0, 13)
+    red_score = 13 if blue_score < 12 else blue_score + 2
+    if rng.random() < 0.5:
+        blue_score, red_score = red_score, blue_score
+    start_date = datetime(2024, 11, 1) + timedelta(seconds=rng.randint(0, 30 * 24 * 60 * 60))
+
+    match_players = []
+    for index in range(10):
+        ability_casts = {'grenade': rng.randint(0, 20), 'ability1': rng.randint(0, 30), 'ability2': rng.randint(0, 30), 'ultimate': rng.randint(0, 5)}
+        match_players.append({
+            'name': f'Player{rng.randint(0, 100000)}',
+            'tag': f'{rng.randint(1000, 9999)}',
+            'team_id': 'Blue' if index < 5 else 'Red',
+            'agent': rng.choice(AGENTS).lower(),
+            'kills': rng.randint(3, 35),
+            'deaths': rng.randint(5, 25),
+            'score': rng.randint(80, 350) * (blue_score + red_score),
+            'assists': rng.randint(0, 15),
+            'headshots': rng.randint(5, 40),
+            'bodyshots': rng.randint(20, 120),
+            'legshots': rng.randint(0, 20),
+            'ability_casts': ability_casts if not legacy else '{' + ', '.join(f'{key}={value}' for key, value in ability_casts.items()) + '}',
+            'tier': rng.choice(TIERS)
+        })
+
+    match_data = {
+        'match_id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'map_name': rng.choice(MAPS),
+        'server': rng.choice(SERVERS),
+        'blue_score': blue_score,
+        'red_score': red_score,
+        'who_won': 'Blue' if blue_score > red_score else 'Red',
+        'match_players': match_players,
+        'start_date': start_date,
+        'end_date': start_date + timedelta(milliseconds=rng.randint(1500000, 3000000)),
+        'schema_version': SCHEMA_VERSION
+    }
+    if legacy:
+        del match_data['who_won']
+        del match_data['schema_version']
+    return match_data
+
+# distinct documents to cycle through, every tenth one is a legacy one
+def make_match_pool(count: int, pool_size: int = 1000) -> list:
+    return [make_match_document(seed, legacy=seed % 10 == 0) for seed in range(min(count, pool_size))]
+
+# count documents cycled from a pool of distinct ones, so a million documents can be streamed
+# without holding a million in memory. pass a pool made once to keep generating it out of timings
+def iter_match_documents(count: int, pool: list = None):
+    if pool == None:
+        pool = make_match_pool(count)
+    for index in range(count):
+        yield pool[index % len(pool)]
@@ -0,0 +1,82 @@
+import os
+import json
+import asyncio
+import argparse
+
+from benchmarks.payloads import make_account_payload, make_mmr_history_payload, make_match_payload
+
+# HenrikDev responses the benchmarks read instead of calling the API, stored as the raw bodies.
+# the committed ones are synthetic, record real ones with:
+#   python -m benchmarks.recording --player name#tag
+# (needs VAL_API_KEY). --synthetic writes the generated ones again
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures')
+FIXTURES = ['account', 'mmr_history', 'match']
+
+def get_fixture_path(name: str) -> str:
+    return os.path.join(FIXTURE_PATH, f'{name}.json')
+
+def load_fixture(name: str) -> bytes:
+    with open(get_fixture_path(name), 'rb') as file:
+        return file.read()
+
+def save_fixture(name: str, raw: bytes):
+    os.makedirs(FIXTURE_PATH, exist_ok=True)
+    with open(get_fixture_path(name), 'wb') as file:
+        file.write(raw)
+    print(f'[Fixtures] wrote {name} ({len(raw) / 1024:.0f} KiB)')
+
+def write_synthetic():
+    save_fixture('account', json.dumps(make_account_payload()).encode())
+    save_fixture('mmr_history', json.dumps(make_mmr_history_payload()).encode())
+    save_fixture('match', json.dumps(make_match_payload()).encode())
+
+async def record(player: str):
+    from dotenv import load_dotenv
+    from utils.http import api_client
+
+    load_dotenv()
+    headers = {"Accept": "application/json", "Authorization": f"{os.getenv('VAL_API_KEY')}"}
+    player_name, player_tag = player.split('#')
+    http = api_client()
+    try:
+        responses = {}
+        status, raw = await http.get_bytes(f'https://api.henrikdev.xyz/valorant/v2/account/{player_name}/{player_tag}', headers=headers)
+        if status != 200:
+            raise RuntimeError(f'account request failed with status {status}')
+        responses['account'] = raw
+        account = json.loads(raw)['data']
+
+        status, raw = await http.get_bytes(f'https://api.henrikdev.xyz/valorant/v1/by-puuid/mmr-history/{account["region"]}/{account["puuid"]}', headers=headers)
+        if status != 200:
+            raise RuntimeError(f'mmr history request failed with status {status}')
+        responses['mmr_history'] = raw
+        history = json.loads(raw)['data']
+        if len(history) == 0:
+            raise RuntimeError(f'{player} has no competitive games to record a match from')
+
+        status, raw = await http.get_bytes(f'https://api.henrikdev.xyz/valorant/v4/match/{account["region"]}/{history[0]["match_id"]}', headers=headers)
+        if status != 200:
+            raise RuntimeError(f'match request failed with status {status}')
+        responses['match'] = raw
+    finally:
+        await http.close()
+
+    # only replace the fixtures once all three were recorded, so they always belong together
+    for name in FIXTURES:
+        save_fixture(name, responses[name])
+
+def main():
+    parser = argparse.ArgumentParser(description='Record the HenrikDev responses the benchmarks use')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--player', help='record the account, mmr history and latest match of name#tag')
+    group.add_argument('--synthetic', action='store_true', help='write generated responses instead')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        write_synthetic()
+    else:
+        asyncio.run(record(args.player))
+
+if __name__ == '__main__':
+    main()
@@ -3,20 +3,63 @@ from nextcord.ext import commands
 from nextcord import application_command as app_commands
 
 import os
+import time
+import asyncio
 from dotenv import load_dotenv
 load_dotenv()
 
-from aiohttp import request
+from utils.http import api_client
+from utils.ratelimit import rate_limiter, shared_rate_limiter, INTERACTIVE, BACKGROUND
+from utils.singleflight import single_flight
+from utils.cache import ttl_cache, lru_cache
+from utils.catalog import content_catalog
+from utils.scheduler import refresh_scheduler
+from utils.models import match_player, comp_match, AGENT_EMOJIS
+from utils.parser import decode_match
+from utils.metrics import metrics_registry, metrics_server, instrument_command
+from utils.watchdog import loop_watchdog
+from utils.stats import get_agent_kill_ratio_pipeline, get_map_win_rate_pipeline, get_server_round_count_pipeline
 
 from datetime import datetime, timezone
-from datetime import timedelta
 
-import pandas as pd
 
-from pymongo.mongo_client import MongoClient
+from utils.db import mongo_db, player_repository, match_repository, rr_history_repository, get_player_key
 
 API_KEY = os.getenv('VAL_API_KEY')
 uri = os.getenv('MONGODB_URI')
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 15))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 100))
+HTTP_POOL_SIZE_PER_HOST = int(os.getenv('HTTP_POOL_SIZE_PER_HOST', 20))
+MATCH_FETCH_CONCURRENCY = int(os.getenv('MATCH_FETCH_CONCURRENCY', 5))
+# requests per period allowed by the HenrikDev key
+HENRIK_RATE_LIMIT = int(os.getenv('HENRIK_RATE_LIMIT', 30))
+HENRIK_RATE_PERIOD = float(os.getenv('HENRIK_RATE_PERIOD', 60))
+# seconds before a cached account is refreshed in the background
+ACCOUNT_CACHE_TTL = float(os.getenv('ACCOUNT_CACHE_TTL', 300))
+# number of recent games read from the rr history
+RR_HISTORY_LIMIT = 10
+# seconds a synced rr history counts as fresh, commands won't call the API again within it
+RR_HISTORY_TTL = float(os.getenv('RR_HISTORY_TTL', 5 * 60))
+# background refreshes of tracked players, the budget is in HenrikDev requests per period
+REFRESH_INTERVAL = float(os.getenv('REFRESH_INTERVAL', 5 * 60))
+REFRESH_BUDGET = int(os.getenv('REFRESH_BUDGET', 10))
+REFRESH_BUDGET_PERIOD = float(os.getenv('REFRESH_BUDGET_PERIOD', 60))
+# bytes of memory the parsed match and rendered match caches may use
+PARSED_MATCH_CACHE_SIZE = int(os.getenv('PARSED_MATCH_CACHE_SIZE', 32 * 1024 * 1024))
+RENDERED_MATCH_CACHE_SIZE = int(os.getenv('RENDERED_MATCH_CACHE_SIZE', 8 * 1024 * 1024))
+CATALOG_PATH = os.getenv('CATALOG_PATH', 'data/content_catalog.json')
+CATALOG_REFRESH_INTERVAL = float(os.getenv('CATALOG_REFRESH_INTERVAL', 6 * 60 * 60))
+# seconds the aggregated Match_Data stats are reused before mongo is asked again
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', 10 * 60))
+# prometheus metrics are served on http://METRICS_HOST:METRICS_PORT/metrics when a port is set,
+# in cluster mode cluster n uses METRICS_PORT + n
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+# seconds the event loop may be blocked before the stack blocking it is logged, 0 turns the watchdog off
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv('LOOP_WATCHDOG_THRESHOLD', 0))
+# discord user ids (comma separated) besides the bot owner that may use /bot_metrics
+BOT_ADMIN_IDS = [int(user_id) for user_id in os.getenv('BOT_ADMIN_IDS', '').split(',') if user_id.strip()]
 
 headers = {
     "Accept": "application/json",
@@ -34,41 +77,170 @@ def get_mmr_change_emoji(change: int) -> str:
     else:
         return '<:neutral:1302749784125472859>'
 
-def get_team_emoji(team_name: str) -> str:
-    if team_name == 'Blue':
-        return '🟦'
-    if team_name == 'Red':
-        return '🟥'
-
 class val(commands.Cog):
-    def __init__(self, client: commands.Bot):
+    # mongo and http are only passed in by the load test (benchmarks/load_test.py) to use local stand-ins
+    def __init__(self, client: commands.Bot, mongo: mongo_db = None, http: api_client = None):
         self.client = client
 
-        self.mongo = MongoClient(uri)
+        self.metrics = metrics_registry()
+        self.mongo = mongo if mongo != None else mongo_db(uri, metrics=self.metrics)
+        self.players = player_repository(self.mongo)
+        self.matches = match_repository(self.mongo)
+        self.rr_history = rr_history_repository(self.mongo)
+        if http == None:
+            # in cluster mode (main.py) every cluster draws from the same HenrikDev quota
+            henrik_rate_state = getattr(client, 'henrik_rate_state', None)
+            henrik_limiter = shared_rate_limiter(henrik_rate_state, HENRIK_RATE_LIMIT, per=HENRIK_RATE_PERIOD) if henrik_rate_state != None else rate_limiter(HENRIK_RATE_LIMIT, per=HENRIK_RATE_PERIOD)
+            http = api_client(total_timeout=HTTP_TIMEOUT, connect_timeout=HTTP_CONNECT_TIMEOUT, pool_size=HTTP_POOL_SIZE, pool_size_per_host=HTTP_POOL_SIZE_PER_HOST, limiters={'api.henrikdev.xyz': henrik_limiter}, metrics=self.metrics)
+        self.http = http
+        self.henrik_limiter = http.get_limiter('https://api.henrikdev.xyz')
+        self.match_fetch_semaphores = {INTERACTIVE: asyncio.Semaphore(MATCH_FETCH_CONCURRENCY), BACKGROUND: asyncio.Semaphore(MATCH_FETCH_CONCURRENCY)}
+        self.match_requests = single_flight()
+        self.account_cache = ttl_cache(ACCOUNT_CACHE_TTL)
+        self.account_requests = single_flight()
+        self.history_requests = single_flight()
+        self.synced_history = ttl_cache(RR_HISTORY_TTL)
+        self.parsed_matches = lru_cache(PARSED_MATCH_CACHE_SIZE, get_size=get_parsed_match_size)
+        self.rendered_matches = lru_cache(RENDERED_MATCH_CACHE_SIZE, get_size=lambda rendered_match: sum(len(line) for line in rendered_match))
+        self.scheduler = refresh_scheduler(self.refresh_player, interval=REFRESH_INTERVAL, budget=REFRESH_BUDGET, budget_period=REFRESH_BUDGET_PERIOD)
+        self.stats_cache = ttl_cache(STATS_CACHE_TTL, max_size=100)
+        self.stats_requests = single_flight()
+        self.background_tasks = set()
+        self.catalog = content_catalog(CATALOG_PATH, self.http)
+        self.catalog.load_from_disk()
+        self.setup_task = self.client.loop.create_task(self.setup_database())
+        self.catalog_task = self.client.loop.create_task(self.update_catalog())
+        self.scheduler_task = self.client.loop.create_task(self.scheduler.run())
+        self.metrics.add_collector(self.collect_metrics)
+        self.metrics_server = None
+        if METRICS_PORT:
+            self.metrics_server = metrics_server(self.metrics, METRICS_HOST, METRICS_PORT + getattr(client, 'cluster_id', 0))
+            self.client.loop.create_task(self.metrics_server.start())
+        self.watchdog = None
+        if LOOP_WATCHDOG_THRESHOLD > 0:
+            self.watchdog = loop_watchdog(threshold=LOOP_WATCHDOG_THRESHOLD, metrics=self.metrics)
+            self.watchdog.start(self.client.loop)
+
+    def cog_unload(self):
+        self.catalog_task.cancel()
+        self.scheduler_task.cancel()
+        if self.metrics_server != None:
+            self.client.loop.create_task(self.metrics_server.stop())
+        if self.watchdog != None:
+            self.watchdog.stop()
+        self.client.loop.create_task(self.http.close())
+        self.mongo.close()
+
+    # numbers the caches, single flights, rate limiter and scheduler already keep, read when the metrics are
+    def collect_metrics(self) -> list:
+        samples = []
+        caches = {'account': self.account_cache, 'synced_history': self.synced_history, 'stats': self.stats_cache, 'parsed_matches': self.parsed_matches, 'rendered_matches': self.rendered_matches}
+        for name, cache in caches.items():
+            stats = cache.stats()
+            labels = {'cache': name}
+            samples.append(('cache_hits_total', labels, stats['hits'], 'counter'))
+            samples.append(('cache_misses_total', labels, stats['misses'], 'counter'))
+            if 'stale_hits' in stats:
+                samples.append(('cache_stale_hits_total', labels, stats['stale_hits'], 'counter'))
+                samples.append(('cache_entries', labels, stats['size'], 'gauge'))
+            else:
+                samples.append(('cache_evictions_total', labels, stats['evictions'], 'counter'))
+                samples.append(('cache_entries', labels, stats['entries'], 'gauge'))
+                samples.append(('cache_size_bytes', labels, stats['size'], 'gauge'))
+
+        single_flights = {'account': self.account_requests, 'rr_history': self.history_requests, 'match': self.match_requests, 'stats': self.stats_requests, 'http': self.http.in_flight}
+        for name, requests in single_flights.items():
+            samples.append(('single_flight_in_flight', {'name': name}, len(requests), 'gauge'))
+
+        if self.henrik_limiter != None:
+            samples.append(('rate_limiter_queued', {'limiter': 'henrikdev'}, len(self.henrik_limiter.waiters), 'gauge'))
+            samples.append(('rate_limiter_tokens', {'limiter': 'henrikdev'}, self.henrik_limiter.get_tokens(), 'gauge'))
+
+        scheduler_stats = self.scheduler.stats()
+        samples.append(('scheduler_tracked_players', None, scheduler_stats['tracked_players'], 'gauge'))
+        samples.append(('scheduler_queued', None, scheduler_stats['queued'], 'gauge'))
+        samples.append(('scheduler_refreshes_total', None, scheduler_stats['refreshes'], 'counter'))
+        samples.append(('background_tasks', None, len(self.background_tasks), 'gauge'))
+        return samples
+
+    async def setup_database(self):
         try:
-            self.mongo.admin.command('ping')
+            await self.mongo.ping()
             print("Pinged the MongoDB database successfully!")
-
-            if 'players' in self.mongo.list_database_names():
-                self.playerdb = self.mongo['players']
-            else:
-                self.playerdb = self.mongo['players']
-                temp_player_df = pd.DataFrame({'player': [''], 'puuid': [''], 'last_updated': [''], 'region': ['']})
-                self.playerdb.Players.insert_many(temp_player_df.to_dict("records"))
-                
-            if 'matches' in self.mongo.list_database_names():
-                self.matchesdb = self.mongo['matches']
-            else:
-                self.matchesdb = self.mongo['matches']
-                temp_matches_df = pd.DataFrame({'match_id': [''], 'match_json': ['']})
-                self.matchesdb.Match_Data.insert_many(temp_matches_df.to_dict("records"))
-
-
         except Exception as e:
             print("Could not connect to the MongoDB database...")
             print(e)
+            return
+
+        # one collection failing to set up shouldn't leave the others without their indexes
+        for name, repository in [('Players', self.players), ('Match_Data', self.matches), ('comp_rr_history', self.rr_history)]:
+            try:
+                await repository.setup()
+            except Exception as e:
+                print(f'Could not set up {name}: {e}')
+
+    # keep the static content catalog in sync with the current game version
+    async def update_catalog(self):
+        await self.client.wait_until_ready()
+        while not self.client.is_closed():
+            try:
+                await self.catalog.refresh()
+            except Exception as e:
+                print(f'[Catalog] could not check for new content: {e}')
+            await asyncio.sleep(CATALOG_REFRESH_INTERVAL)
+
+    # returns (status, account, last_updated) where last_updated is when the account was refreshed before this lookup
+    # fresh accounts come from memory or the Players collection, stale ones are returned right away and refreshed in the background
+    async def get_account(self, player: str):
+        player_key = get_player_key(player)
+        account, is_stale = self.account_cache.get(player_key)
+        if account == None:
+            player_doc = await self.players.find_by_name(player)
+            if player_doc != None and 'account_level' in player_doc:
+                account = get_account_from_player(player_doc)
+                cached_at = player_doc.get('account_cached_at', 0)
+                self.account_cache.set(player_key, account, cached_at)
+                is_stale = time.time() - cached_at > self.account_cache.ttl
+
+        if account == None:
+            status, account, player_doc = await self.account_requests.do_with_priority(player_key, INTERACTIVE, self.refresh_account, player, INTERACTIVE)
+            if account == None:
+                return status, None, None
+            return status, account, player_doc['last_updated'] if player_doc != None else None
+
+        if is_stale:
+            task = asyncio.create_task(self.account_requests.do_with_priority(player_key, BACKGROUND, self.refresh_account, player, BACKGROUND))
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+        return 200, account, account['updated_at']
+
+    # get the account from the API and save it, returns (status, account, player document before the update)
+    async def refresh_account(self, player: str, priority: int = INTERACTIVE):
+        player_name, player_tag = player.split('#')
+        account_data_url = f'https://api.henrikdev.xyz/valorant/v2/account/{player_name}/{player_tag}?force=true'
+        status, data = await self.http.get_json(account_data_url, headers=headers, priority=priority, endpoint='account')
+        if status != 200:
+            return status, None, None
+
+        data = data['data']
+        account = {
+            'puuid': data['puuid'],
+            'region': data['region'].upper(),
+            'account_level': int(data['account_level']),
+            'title': data.get('title'),
+            'card': data.get('card'),
+            'updated_at': data['updated_at']
+        }
+        player_doc = await self.players.upsert(account['puuid'], {'player': str(player), 'last_updated': account['updated_at'], 'region': account['region'], 'account_level': account['account_level'], 'title': account['title'], 'card': account['card'], 'account_cached_at': time.time()})
+        if player_doc != None:
+            print(f'{player} is in the player database! Updated document...')
+        else:
+            print(f'{player} saved to database!')
+        self.account_cache.set(get_player_key(player), account)
+        return status, account, player_doc
 
     @app_commands.slash_command(name='val_stats', description='Get valorant stats for a player')
+    @instrument_command
     async def val_stats(self, interaction: discord.Interaction, player):
         await interaction.response.defer()
 
@@ -80,161 +252,39 @@ class val(commands.Cog):
         player_name = unfiltered_player_name[0]
         player_tag = unfiltered_player_name[1]
 
-        val_player_obj = None
-        player_df = pd.DataFrame(list(self.playerdb.Players.find()), columns=['player', 'puuid', 'last_updated', 'region'])
-        player_df.astype(str)
-
-        last_updated = None
         should_update_match_history = False
 
-        account_data_url = f'https://api.henrikdev.xyz/valorant/v2/account/{player_name}/{player_tag}?force=true'
-        async with request('GET', account_data_url, headers=headers) as response:
-            if response.status == 200:
-                data = await response.json()
-                data = data['data']
-                card_id, title_id = None, None
-                val_player_obj = None
-                
-                if 'card' in data:
-                    card_id = data['card']
-                if 'title' in data:
-                    title_id = data['title']
-
-                val_player_obj = val_player(data['puuid'], player_name, player_tag, data['region'].upper(), int(data['account_level']), title_id, card_id)
-                last_updated = data['updated_at']
-            else:
-                await interaction.followup.send(f'Error getting data for {player}: Status {response.status}')
-                return
+        status, account, last_updated = await self.get_account(player)
+        if account == None:
+            await interaction.followup.send(f'Error getting data for {player}: Status {status}')
+            return
 
-        if player_df['puuid'].str.contains(val_player_obj.puuid).any():
-            player_df.loc[player_df.puuid == val_player_obj.puuid, 'player'] = str(player)
-            delta = datetime.now(timezone.utc) - datetime.fromisoformat(player_df.loc[(player_df['puuid'] == val_player_obj.puuid), 'last_updated'].values[0])
+        val_player_obj = val_player(account['puuid'], player_name, player_tag, account['region'], account['account_level'], account['title'], account['card'])
+        self.scheduler.track(val_player_obj.puuid, val_player_obj.puuid, val_player_obj.region)
+        if last_updated != None:
+            delta = datetime.now(timezone.utc) - datetime.fromisoformat(last_updated)
             if abs(delta.total_seconds()) > (5 * 60):
                 should_update_match_history = True
-            self.playerdb.Players.update_one({'puuid': val_player_obj.puuid}, {'$set' :{'player': player, 'last_updated': last_updated, 'region':val_player_obj.region}})
-            print(f'{player} is in the player database! Attempting to update document...')
-        else:
-            individual_player_df = pd.DataFrame({'player':[str(player)], 'puuid':[val_player_obj.puuid], 'last_updated': [last_updated], 'region':[val_player_obj.region]})
-            self.playerdb.Players.insert_many(individual_player_df.to_dict("records"))
-            print(f'{player} saved to database!')
 
-        # if puuid of the val player is in the database
-        mmr_changes, match_maps, match_ids, match_times = [], [], [], []
-        account_rank_history, account_rr_history, account_rank_url_history = [], [], []
-        match_info = []
-        max_count = 0
-        if f'{val_player_obj.puuid}' in self.mongo.list_database_names():
-            print(f'Getting match history for {player} in the database...')
-            match_df = pd.DataFrame(list(self.mongo[f'{val_player_obj.puuid}'].comp_rr_history.find()), columns=['match_id', 'map', 'mmr_change', 'date', 'rank', 'current_mmr', 'rank_image_url']).sort_values('date', ascending=False)
-            if should_update_match_history:
-                print(f'Attempting to update match history for {player}...')
-                account_mmr_history_url = f'https://api.henrikdev.xyz/valorant/v1/by-puuid/mmr-history/{val_player_obj.region}/{val_player_obj.puuid}'
-                async with request('GET', account_mmr_history_url, headers=headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        data = data['data']
-
-                        if len(data) < 1:
-                            await interaction.followup.send(f'{player} has no recently logged ranked games')
-                            return
-
-                        new_mmr_changes, new_match_maps, new_match_ids, new_match_times = [], [], [], []
-                        new_account_rank_history, new_account_rr_history, new_account_rank_url_history = [], [], []
-                        
-                        count = 0
-                        max_count = min(10, len(data))
-                        while count < max_count:
-                            match = data[count]
-                            match_id = match['match_id']
-                            mmr_change = match['mmr_change_to_last_game']
-                            match_map = match['map']['name']
-                            account_rank = match['currenttierpatched']
-                            account_rr = match['ranking_in_tier']
-                            account_rank_url = match['images']['small']
-                            date = int(match['date_raw'])
-
-                            new_match_ids.append(match_id)
-                            new_match_maps.append(match_map)
-                            new_mmr_changes.append(int(mmr_change))
-                            new_match_times.append(datetime.fromtimestamp(date))
-                            new_account_rank_history.append(account_rank)
-                            new_account_rr_history.append(account_rr)
-                            new_account_rank_url_history.append(account_rank_url)
-                            count += 1
-                        new_match_df = pd.DataFrame({'match_id': new_match_ids, 'map': new_match_maps, 'mmr_change': new_mmr_changes, 'date': new_match_times, 'rank': new_account_rank_history, 'current_mmr': new_account_rr_history, 'rank_image_url': new_account_rank_url_history})
-                        # get duplicate match ids
-                        existing_match_ids = set(match_df['match_id'])
-                        new_unique_match_ids = [match_id for match_id in new_match_ids if match_id not in existing_match_ids]
-
-                        # filter new_match_df to keep only unique rows
-                        unique_new_match_df = new_match_df[new_match_df['match_id'].isin(new_unique_match_ids)]
-
-                        # insert unique rows
-                        if not unique_new_match_df.empty:
-                            self.mongo[f'{val_player_obj.puuid}'].comp_rr_history.insert_many(unique_new_match_df.to_dict('records'))
-
-                        match_df = pd.DataFrame(list(self.mongo[f'{val_player_obj.puuid}'].comp_rr_history.find()), columns=['match_id', 'map', 'mmr_change', 'date', 'rank', 'current_mmr', 'rank_image_url']).sort_values('date', ascending=False)
-
-            match_ids = list(match_df['match_id'])
-            match_maps = list(match_df['map'])
-            mmr_changes = list(match_df['mmr_change'])
-            match_times = list(match_df['date'])
-            account_rank_history = list(match_df['rank'])
-            account_rr_history = list(match_df['current_mmr'])
-            account_rank_url_history = list(match_df['rank_image_url'])
-            max_count = min(10, len(match_ids))
-            for i in range(max_count):
-                match_info.append(f'{mmr_changes[i]} ({match_maps[i]})')
-            
-        else:
-            # else add to database
-            print(f'Getting match history for {player} from the API...')
-            account_mmr_history_url = f'https://api.henrikdev.xyz/valorant/v1/by-puuid/mmr-history/{val_player_obj.region}/{val_player_obj.puuid}'
-            async with request('GET', account_mmr_history_url, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    data = data['data']
-
-                    if len(data) < 1:
-                        await interaction.followup.send(f'{player} has no recently logged ranked games')
-                        return
-                    
-                    count = 0
-                    max_count = min(10, len(data))
-                    while count < max_count:
-                        match = data[count]
-                        match_id = match['match_id']
-                        mmr_change = match['mmr_change_to_last_game']
-                        match_map = match['map']['name']
-                        account_rank = match['currenttierpatched']
-                        account_rr = match['ranking_in_tier']
-                        account_rank_url = match['images']['small']
-                        date = int(match['date_raw'])
-
-                        match_ids.append(match_id)
-                        match_maps.append(match_map)
-                        mmr_changes.append(int(mmr_change))
-                        match_times.append(datetime.fromtimestamp(date))
-                        account_rank_history.append(account_rank)
-                        account_rr_history.append(account_rr)
-                        account_rank_url_history.append(account_rank_url)
-                        match_info.append(f'{mmr_change} ({match_map})')
-                        count += 1
-
-                    # get match df and upsert (update and insert) into mongodb
-                    match_df = pd.DataFrame({'match_id': match_ids, 'map': match_maps, 'mmr_change': mmr_changes, 'date': match_times, 'rank': account_rank_history, 'current_mmr': account_rr_history, 'rank_image_url': account_rank_url_history})
-                    self.mongo[f'{val_player_obj.puuid}'].comp_rr_history.insert_many(match_df.to_dict("records"))
- 
+        history = await self.get_rr_history(val_player_obj.puuid, val_player_obj.region, should_update_match_history)
+        if len(history) < 1:
+            await interaction.followup.send(f'{player} has no recently logged ranked games')
+            return
+
+        max_count = min(10, len(history))
+        mmr_changes = [entry['mmr_change'] for entry in history[:max_count]]
+        match_info = [f"{entry['mmr_change']} ({entry['map']})" for entry in history[:max_count]]
+
         # get current rank
-        account_rank = account_rank_history[0]
-        account_rr = account_rr_history[0]
-        account_rank_url = account_rank_url_history[0]
+        account_rank = history[0]['rank']
+        account_rr = history[0]['current_mmr']
+        account_rank_url = history[0]['rank_image_url']
 
         # Test embed
         embed=discord.Embed(description=f'', color=0x36ecc8)
         embed.add_field(name='Level', value=val_player_obj.level, inline=True)
         if val_player_obj.has_title:
-            player_title = await val_player_obj.getTitle()
+            player_title = val_player_obj.getTitle(self.catalog)
             if player_title != None:
                 embed.add_field(name='Title', value=player_title, inline=True)
         
@@ -249,11 +299,73 @@ class val(commands.Cog):
             embed.set_author(name=f'{player} ({val_player_obj.region})')
         
         if val_player_obj.has_card:
-            embed.set_thumbnail(url=f'{val_player_obj.getCardPfpUrl()}')
+            embed.set_thumbnail(url=f'{val_player_obj.getCardPfpUrl(self.catalog)}')
 
         await interaction.followup.send(embed=embed)
 
+    # newest games of a player, synced with the API when none are stored yet or should_update is set
+    async def get_rr_history(self, puuid: str, region: str, should_update: bool) -> list:
+        history = await self.rr_history.find_latest(puuid, RR_HISTORY_LIMIT)
+        synced, is_stale = self.synced_history.get(puuid)
+        if len(history) > 0 and (not should_update or (synced != None and not is_stale)):
+            return history
+        print(f'Attempting to update match history for {puuid}...')
+        return await self.history_requests.do_with_priority(puuid, INTERACTIVE, self.sync_rr_history, puuid, region, history, INTERACTIVE)
+
+    # only games newer than the latest stored one are written, as one idempotent bulk upsert,
+    # and the newest games are merged in memory instead of being read back
+    async def sync_rr_history(self, puuid: str, region: str, history: list, priority: int = INTERACTIVE) -> list:
+        account_mmr_history_url = f'https://api.henrikdev.xyz/valorant/v1/by-puuid/mmr-history/{region}/{puuid}'
+        status, data = await self.http.get_json(account_mmr_history_url, headers=headers, priority=priority, endpoint='mmr_history')
+        if status != 200:
+            print(f'ERROR: REPSONSE STATUS {status} for {account_mmr_history_url}')
+            return history
+        self.synced_history.set(puuid, True)
+
+        latest_date = history[0]['date'] if len(history) > 0 else None
+        new_history = [entry for entry in map(get_rr_history_entry, data['data']) if latest_date == None or entry['date'] > latest_date]
+        if len(new_history) == 0:
+            return history
+
+        new_history.sort(key=lambda entry: entry['date'], reverse=True)
+        await self.rr_history.upsert_many(puuid, new_history)
+        return (new_history + history)[:RR_HISTORY_LIMIT]
+
+    # background refresh of a tracked player's rr history and recent matches, returns the number of API calls made
+    async def refresh_player(self, puuid: str, region: str) -> int:
+        calls = 0
+        history = await self.rr_history.find_latest(puuid, RR_HISTORY_LIMIT)
+        synced, is_stale = self.synced_history.get(puuid)
+        if synced == None or is_stale:
+            history = await self.history_requests.do_with_priority(puuid, BACKGROUND, self.sync_rr_history, puuid, region, history, BACKGROUND)
+            calls += 1
+
+        match_ids = [entry['match_id'] for entry in history[:5]]
+        cached_matches = await self.matches.find_many(match_ids)
+        missing_match_ids = [match_id for match_id in match_ids if match_id not in cached_matches]
+        await asyncio.gather(*[self.fetch_match(region, match_id, BACKGROUND) for match_id in missing_match_ids], return_exceptions=True)
+        return calls + len(missing_match_ids)
+
+    # get a match from the API and save it, concurrent lookups of the same match share one request and write
+    async def fetch_match(self, region: str, match_id: str, priority: int = INTERACTIVE) -> dict:
+        return await self.match_requests.do_with_priority(match_id, priority, self.download_match, region, match_id, priority)
+
+    # bounded so one command can't open too many requests at once. background downloads have their own
+    # bound, so they can't take the slots of a command while they wait for background tokens
+    async def download_match(self, region: str, match_id: str, priority: int = INTERACTIVE) -> dict:
+        async with self.match_fetch_semaphores[priority]:
+            match_url = f'https://api.henrikdev.xyz/valorant/v4/match/{region.lower()}/{match_id}'
+            status, raw = await self.http.get_bytes(match_url, headers=headers, priority=priority, endpoint='match')
+            if status != 200:
+                print(f'ERROR: REPSONSE STATUS {status} for {match_url}')
+                return None
+
+        match_data = decode_match(raw)
+        await self.matches.save(match_data)
+        return match_data
+
     @app_commands.slash_command(name='comp_history', description='Get a valorant players competitive history')
+    @instrument_command
     async def comp_history(self, interaction: discord.Interaction, player):
         await interaction.response.defer()
 
@@ -262,202 +374,161 @@ class val(commands.Cog):
             await interaction.followup.send(f'Error: {player} is not a valid player name!')
             return
 
-        player_name = unfiltered_player_name[0]
-        player_tag = unfiltered_player_name[1]
         player_uuid = None
         should_update_match_history = False
 
-        player_df = pd.DataFrame(list(self.playerdb.Players.find()), columns=['player', 'puuid', 'last_updated', 'region'])
-        matches_df = pd.DataFrame(list(self.matchesdb.Match_Data.find()), columns=['map_name', 'server', 'match_id', 'blue_score', 'red_score', 'who_won', 'match_players', 'start_date', 'end_date'])
-        player_df.astype(str)
-
+        player_doc = await self.players.find_by_name(player)
         try:
-            player_uuid = player_df.loc[player_df.player.str.lower() == str(player).lower(), 'puuid'].values[0]
-            player_region = player_df.loc[player_df.player.str.lower() == str(player).lower(), 'region'].values[0]
-            delta = datetime.now(timezone.utc) - datetime.fromisoformat(player_df.loc[(player_df['puuid'] == player_uuid), 'last_updated'].values[0])
+            player_uuid = player_doc['puuid']
+            player_region = player_doc['region']
+            delta = datetime.now(timezone.utc) - datetime.fromisoformat(player_doc['last_updated'])
             if abs(delta.total_seconds()) > (5 * 60):
                 should_update_match_history = True
-        except (KeyError, IndexError):
+        except (KeyError, TypeError):
             await interaction.followup.send(f'{player} not in local database! Check that you have the correct tag, or do "/val_stats {player}" before running this command again.')
             return
 
-        if f'{player_uuid}' in self.mongo.list_database_names():
-            print(f'Getting match history for {player} from the database...')
-            print(f'REGION: {player_region}')
-            match_df = pd.DataFrame(list(self.mongo[f'{player_uuid}'].comp_rr_history.find()), columns=['match_id', 'map', 'mmr_change', 'date', 'rank', 'current_mmr', 'rank_image_url']).sort_values('date', ascending=False)
-            if should_update_match_history:
-                print(f'Attempting to update match history for {player}...')
-                account_mmr_history_url = f'https://api.henrikdev.xyz/valorant/v1/by-puuid/mmr-history/{player_region}/{player_uuid}'
-                async with request('GET', account_mmr_history_url, headers=headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        data = data['data']
-
-                        if len(data) < 1:
-                            await interaction.followup.send(f'{player} has no recently logged ranked games')
-                            return
-
-                        new_mmr_changes, new_match_maps, new_match_ids, new_match_times = [], [], [], []
-                        new_account_rank_history, new_account_rr_history, new_account_rank_url_history = [], [], []
-                        
-                        count = 0
-                        max_count = min(10, len(data))
-                        while count < max_count:
-                            match = data[count]
-                            match_id = match['match_id']
-                            mmr_change = match['mmr_change_to_last_game']
-                            match_map = match['map']['name']
-                            account_rank = match['currenttierpatched']
-                            account_rr = match['ranking_in_tier']
-                            account_rank_url = match['images']['small']
-                            date = int(match['date_raw'])
-
-                            new_match_ids.append(match_id)
-                            new_match_maps.append(match_map)
-                            new_mmr_changes.append(int(mmr_change))
-                            new_match_times.append(datetime.fromtimestamp(date))
-                            new_account_rank_history.append(account_rank)
-                            new_account_rr_history.append(account_rr)
-                            new_account_rank_url_history.append(account_rank_url)
-                            count += 1
-                        new_match_df = pd.DataFrame({'match_id': new_match_ids, 'map': new_match_maps, 'mmr_change': new_mmr_changes, 'date': new_match_times, 'rank': new_account_rank_history, 'current_mmr': new_account_rr_history, 'rank_image_url': new_account_rank_url_history})
-                        # get duplicate match ids
-                        existing_match_ids = set(match_df['match_id'])
-                        new_unique_match_ids = [match_id for match_id in new_match_ids if match_id not in existing_match_ids]
-
-                        # filter new_match_df to keep only unique rows
-                        unique_new_match_df = new_match_df[new_match_df['match_id'].isin(new_unique_match_ids)]
-
-                        # insert unique rows
-                        if not unique_new_match_df.empty:
-                            self.mongo[f'{player_uuid}'].comp_rr_history.insert_many(unique_new_match_df.to_dict('records'))
-
-                        match_df = pd.DataFrame(list(self.mongo[f'{player_uuid}'].comp_rr_history.find()), columns=['match_id', 'map', 'mmr_change', 'date', 'rank', 'current_mmr', 'rank_image_url']).sort_values('date', ascending=False)
-                    else:
-                        print(f'ERROR: REPSONSE STATUS {response.status}')
-            match_ids = list(match_df['match_id'])
-            mmr_changes = list(match_df['mmr_change'])
-            max_count = min(5, len(match_ids)) # Get first 5 match ids
-            formatted_match_strings = []
-            if max_count == 0:
-                await interaction.followup.send(f'{player} has not played a competitive match yet!')
-                return
-            
-            for i in range(max_count):
-                if matches_df['match_id'].str.contains(match_ids[i]).any():
-                    print(f'Getting match data for {match_ids[i]} in the database...')
-                    
-                    match_row = matches_df[matches_df['match_id'] == match_ids[i]]
-                    match_data = match_row.iloc[0]
-                    lookup_team = None
-                    match_players = []
-                    for player_data in match_data["match_players"]:
-                        match_player_obj = match_player(player_data["name"], player_data["tag"], player_data["team_id"], player_data["agent"], player_data["kills"], player_data["deaths"], player_data["score"], player_data["assists"], player_data["headshots"], player_data["bodyshots"], player_data["legshots"], player_data["ability_casts"]["grenade"], player_data["ability_casts"]["ability1"], player_data["ability_casts"]["ability2"], player_data["ability_casts"]["ultimate"], player_data["tier"])
-                        match_players.append(match_player_obj)
-                        if player_name.lower() == match_player_obj.player_name.lower() and player_tag.lower() == match_player_obj.player_tag.lower():
-                            lookup_team = player_data['team_id']
-                    match_obj = comp_match(match_data['map_name'], match_data['server'], match_data['match_id'], match_data['blue_score'], match_data['red_score'], match_data['who_won'], match_players, lookup_team, player, match_data['start_date'], match_data['end_date'])
-                    formatted_match_strings.append(match_obj.get_formatted_map())
-                else:
-                    print(f'Getting match data for {match_ids[i]} in the API...')
-                    async with request('GET', f'https://api.henrikdev.xyz/valorant/v4/match/{player_region.lower()}/{match_ids[i]}', headers=headers) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            data = data['data']
-                            metadata = data['metadata']
-                            players = data['players']
-                            teams = data['teams']
-
-                            lookup_team = None
-                            match_players = []
-                            blue_score = 0
-                            red_score = 0
-                            who_won = None
-                            match_start_time = datetime.strptime(metadata['started_at'], "%Y-%m-%dT%H:%M:%S.%fZ")
-                            match_finish_time = match_start_time + timedelta(milliseconds=int(metadata['game_length_in_ms']))
-
-                            # print(f"Map: {metadata['map']['name']}, Server: {metadata['cluster']}, Match ID: {metadata['match_id']}")
-                            for player_index in range(len(players)):
-                                player_data = players[player_index]
-                                player_stats = player_data['stats']
-                                ability_casts = player_data['ability_casts']
-                                match_player_obj = match_player(player_data['name'], player_data['tag'], player_data['team_id'], player_data['agent']['name'].lower(), player_stats['kills'], player_stats['deaths'], player_stats['score'], player_stats['assists'], player_stats['headshots'], player_stats['bodyshots'], player_stats['legshots'], ability_casts['grenade'], ability_casts['ability1'], ability_casts['ability2'], ability_casts['ultimate'], player_data['tier']['name'])
-                                if player_name.lower() == player_data['name'].lower() and player_tag.lower() == player_data['tag'].lower():
-                                    lookup_team = player_data['team_id']
-                                match_players.append(match_player_obj)
-
-                            for team_index in range(len(teams)):
-                                team_data = teams[team_index]
-                                if team_data['team_id'] == 'Red':
-                                    red_score = team_data['rounds']['won']
-                                    if team_data['won'] == True:
-                                        who_won = 'Red'
-                                elif team_data['team_id'] == 'Blue':
-                                    blue_score = team_data['rounds']['won']
-                                    if team_data['won'] == True:
-                                        who_won = 'Blue'
-                            if who_won == None:
-                                who_won = 'Tie'
-                            
-                            match_obj = comp_match(metadata['map']['name'], metadata['cluster'], metadata['match_id'], blue_score, red_score, who_won, match_players, lookup_team, player, match_start_time, match_finish_time)
-                            formatted_match_strings.append(match_obj.get_formatted_map())
-                            
-                            player_data_list = []
-                            for p in match_players:
-                                player_data = {
-                                    "name": p.player_name,
-                                    "tag": p.player_tag,
-                                    "team_id": p.team_id,
-                                    "agent": p.agent_name,
-                                    "kills": p.kills,
-                                    "deaths": p.deaths,
-                                    "score": p.score,
-                                    "assists": p.assists,
-                                    "headshots": p.headshots,
-                                    "bodyshots": p.bodyshots,
-                                    "legshots": p.legshots,
-                                    "ability_casts": {
-                                        "grenade": p.e_ability,
-                                        "ability1": p.c_ability,
-                                        "ability2": p.q_ability,
-                                        "ultimate": p.x_ability
-                                    },
-                                    "tier": p.rank_in_match
-                                }
-                                player_data_list.append(player_data)
-                                
-                            match_data = {
-                                "map_name": match_obj.map_name,
-                                "server": match_obj.server,
-                                "match_id": match_obj.match_id,
-                                "blue_score": match_obj.blue_score,
-                                "red_score": match_obj.red_score,
-                                "who_won": who_won,
-                                "match_players": player_data_list,
-                                "start_date": match_obj.start_date,
-                                "end_date": match_obj.end_date
-                            }
-                            
-                            self.matchesdb['Match_Data'].insert_one(match_data)
-                        else:
-                            print(f'ERROR: REPSONSE STATUS {response.status} for https://api.henrikdev.xyz/valorant/v4/match{player_region.lower()}/{match_ids[i]}')
-
-            max_count = len(formatted_match_strings)
-            embed=discord.Embed(description='', color=0x3c88eb)
-            embed.set_author(name=f'{player} | LAST {max_count} GAMES')
-            print(len(formatted_match_strings), max_count)
-            for i in range(max_count):
-                # print(formatted_match_strings[i])
-                try:
-                    embed.add_field(name=formatted_match_strings[i][0] + f' ({get_mmr_change_emoji(mmr_changes[i])} {mmr_changes[i]} RR)', value=formatted_match_strings[i][1], inline=False)
-                except Exception as e:
-                    print(e)
-            await interaction.followup.send(embed=embed)
+        self.scheduler.track(player_uuid, player_uuid, player_region)
+        print(f'Getting match history for {player} from the database...')
+        history = await self.get_rr_history(player_uuid, player_region, should_update_match_history)
+        match_ids = [entry['match_id'] for entry in history]
+        mmr_changes = [entry['mmr_change'] for entry in history]
+        max_count = min(5, len(match_ids)) # Get first 5 match ids
+        if max_count == 0:
+            await interaction.followup.send(f'{player} has not played a competitive match yet!')
+            return
 
-        else:
-            await interaction.followup.send(f'{player} not in local database, please run "/val_player {player}" again to load the player again!')
+        # rendered embed fields are cached per lookup player, parsed matches are shared between players,
+        # and only matches in neither cache are read from mongo (or the API when they aren't stored yet)
+        player_key = get_player_key(player)
+        recent_match_ids = match_ids[:max_count]
+        rendered_matches = {}
+        parsed_matches = {}
+        for match_id in recent_match_ids:
+            rendered_match = self.rendered_matches.get((match_id, player_key))
+            if rendered_match != None:
+                rendered_matches[match_id] = rendered_match
+                continue
+            parsed_match = self.parsed_matches.get(match_id)
+            if parsed_match != None:
+                parsed_matches[match_id] = parsed_match
+
+        unparsed_match_ids = [match_id for match_id in recent_match_ids if match_id not in rendered_matches and match_id not in parsed_matches]
+        if unparsed_match_ids:
+            cached_matches = await self.matches.find_many(unparsed_match_ids)
+            missing_match_ids = [match_id for match_id in unparsed_match_ids if match_id not in cached_matches]
+            if missing_match_ids:
+                print(f'Getting match data for {len(missing_match_ids)} matches from the API...')
+                fetched_matches = await asyncio.gather(*[self.fetch_match(player_region, match_id) for match_id in missing_match_ids], return_exceptions=True)
+                for match_id, match_data in zip(missing_match_ids, fetched_matches):
+                    if isinstance(match_data, Exception):
+                        print(f'ERROR: could not get match data for {match_id}: {match_data}')
+                    elif match_data != None:
+                        cached_matches[match_id] = match_data
+
+            for match_id, match_data in cached_matches.items():
+                parsed_match = get_parsed_match(match_data)
+                self.parsed_matches.set(match_id, parsed_match)
+                parsed_matches[match_id] = parsed_match
+
+        for match_id, parsed_match in parsed_matches.items():
+            rendered_match = get_player_match(parsed_match, player).get_formatted_map()
+            self.rendered_matches.set((match_id, player_key), rendered_match)
+            rendered_matches[match_id] = rendered_match
+
+        # keep the matches in mmr history order, skipping any that could not be loaded
+        formatted_matches = [(rendered_matches[match_id], mmr_changes[i]) for i, match_id in enumerate(recent_match_ids) if match_id in rendered_matches]
+
+        max_count = len(formatted_matches)
+        embed=discord.Embed(description='', color=0x3c88eb)
+        embed.set_author(name=f'{player} | LAST {max_count} GAMES')
+        for formatted_match_strings, mmr_change in formatted_matches:
+            try:
+                embed.add_field(name=formatted_match_strings[0] + f' ({get_mmr_change_emoji(mmr_change)} {mmr_change} RR)', value=formatted_match_strings[1], inline=False)
+            except Exception as e:
+                print(e)
+        await interaction.followup.send(embed=embed)
+
+    # the stats are the same for everyone, so one aggregation is shared by every command in the next STATS_CACHE_TTL seconds
+    async def get_stats(self, key, pipeline: list) -> list:
+        rows, is_stale = self.stats_cache.get(key)
+        if rows != None and not is_stale:
+            return rows
+        rows = await self.stats_requests.do(key, self.matches.aggregate, pipeline)
+        self.stats_cache.set(key, rows)
+        return rows
+
+    @app_commands.slash_command(name='agent_stats', description='Get kills per round for every agent in the match database')
+    @instrument_command
+    async def agent_stats(self, interaction: discord.Interaction, map_name: str = None):
+        await interaction.response.defer()
+
+        map_name = map_name.strip().capitalize() if map_name else None
+        rows = await self.get_stats(('agents', map_name), get_agent_kill_ratio_pipeline(map_name))
+        if len(rows) == 0:
+            await interaction.followup.send(f'No matches found{f" on {map_name}" if map_name else ""}!')
             return
 
+        lines = [f'{AGENT_EMOJIS.get(row["agent"], "")} **{row["agent"]}** | K/R: {row["kill_ratio"]:.2f} | Avg K/R: {row["average_kill_ratio"]:.2f} | {row["games"]} games' for row in rows]
+        embed=discord.Embed(description='\n'.join(lines), color=0x36ecc8)
+        embed.set_author(name=f'KILLS PER ROUND BY AGENT{f" | {map_name.upper()}" if map_name else ""}')
+        await interaction.followup.send(embed=embed)
+
+    @app_commands.slash_command(name='map_stats', description='Get the win rate of each team on every map in the match database')
+    @instrument_command
+    async def map_stats(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+
+        rows = await self.get_stats('maps', get_map_win_rate_pipeline())
+        if len(rows) == 0:
+            await interaction.followup.send('No matches found!')
+            return
+
+        lines = [f'**{row["map_name"]}** | 🟦 {row["blue_win_rate"] * 100:.1f}% | 🟥 {row["red_win_rate"] * 100:.1f}% | {row["games"]} games' for row in rows]
+        embed=discord.Embed(description='\n'.join(lines), color=0x3c88eb)
+        embed.set_author(name='WIN RATE BY MAP')
+        await interaction.followup.send(embed=embed)
+
+    @app_commands.slash_command(name='server_stats', description='Get the number of rounds played on each server in the match database')
+    @instrument_command
+    async def server_stats(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+
+        rows = await self.get_stats('servers', get_server_round_count_pipeline())
+        if len(rows) == 0:
+            await interaction.followup.send('No matches found!')
+            return
+
+        lines = [f'**{row["server"]}** | {row["rounds"]} rounds | {row["games"]} games | {row["average_rounds"]:.1f} rounds per game' for row in rows[:25]]
+        embed=discord.Embed(description='\n'.join(lines), color=0x3c88eb)
+        embed.set_author(name='ROUNDS BY SERVER')
+        await interaction.followup.send(embed=embed)
+
+    async def is_bot_admin(self, user) -> bool:
+        return user.id in BOT_ADMIN_IDS or await self.client.is_owner(user)
+
+    @app_commands.slash_command(name='bot_metrics', description='Show where the bot spends its time (bot admins only)', default_member_permissions=discord.Permissions(administrator=True))
+    @instrument_command
+    async def bot_metrics(self, interaction: discord.Interaction):
+        if not await self.is_bot_admin(interaction.user):
+            await interaction.response.send_message('Only bot admins can see the bot metrics!', ephemeral=True)
+            return
+
+        counters, gauges = self.metrics.collect()
+        histograms = self.metrics.histograms
+        embed=discord.Embed(description='', color=0x3c88eb)
+        embed.set_author(name='BOT METRICS')
+        for name, value in [
+            ('Commands', get_latency_lines(histograms.get('command_seconds', {}), counters.get('command_errors_total', {}), 'command')),
+            ('HenrikDev / HTTP', get_http_lines(histograms.get('http_request_seconds', {}), counters.get('http_requests_total', {}))),
+            ('Mongo (slowest 5)', get_latency_lines(histograms.get('mongo_operation_seconds', {}), counters.get('mongo_operation_errors_total', {}), 'operation', limit=5)),
+            ('Caches', get_cache_lines(counters)),
+            ('In flight', get_in_flight_lines(gauges)),
+            ('Event loop stalls', get_stall_lines(histograms.get('loop_lag_seconds', {}), counters.get('loop_stalls_total', {})))
+        ]:
+            embed.add_field(name=name, value=value[:1024] or 'nothing yet', inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
 class val_player():
 
     def __init__(self, puuid, player_name, player_tag, region, level, title_id, card_id):
@@ -472,156 +543,113 @@ class val_player():
         self.card_id = str(card_id)
 
     # Get the player's card (small/pfp) image if it exists
-    def getCardPfpUrl(self) -> str:
+    def getCardPfpUrl(self, catalog: content_catalog) -> str:
         if self.has_card:
-            return f'https://media.valorant-api.com/playercards/{self.card_id}/smallart.png'
+            # the catalog may not have been downloaded yet, the image url only depends on the card id
+            return catalog.get_card_url(self.card_id) or f'https://media.valorant-api.com/playercards/{self.card_id}/smallart.png'
         else:
             return None
         
     # Get the player's title if it exists
-    async def getTitle(self) -> str:
+    def getTitle(self, catalog: content_catalog) -> str:
         if self.has_title:
-            title_link_url = f'https://valorant-api.com/v1/playertitles/{self.title_id}'
-            async with request('GET', title_link_url, headers={}) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    data = data['data']
-                    return data['titleText']
-                else:
-                    return None
+            return catalog.get_title(self.title_id)
         else:
             return None
-    
-class match_player():
-    def __init__(self, player_name, player_tag, team_id, agent_name, kills, deaths, score, assists, headshots, bodyshots, legshots, e_ability, c_ability, q_ability, x_ability, rank_in_match):
-        self.player_name = player_name
-        self.player_tag = player_tag
-        self.team_id = team_id
-        self.agent_name = agent_name
-        self.kills = int(kills)
-        self.deaths = int(deaths)
-        self.score = int(score)
-        self.assists = int(assists)
-        self.headshots = int(headshots)
-        self.bodyshots = int(bodyshots)
-        self.legshots = int(legshots)
-        if e_ability != None:
-            self.e_ability = int(e_ability)
-        else:
-            self.e_ability = 0
-        if c_ability != None:
-            self.c_ability = int(c_ability)
-        else:
-            self.c_ability = 0
-        if q_ability != None:
-            self.q_ability = int(q_ability)
-        else:
-            self.q_ability = 0
-        if x_ability != None:
-            self.x_ability = int(x_ability)
-        else:
-            self.x_ability = 0
-        self.rank_in_match = rank_in_match
-
-    def get_full_tag(self):
-        return self.player_name + "#" + self.player_tag
-
-    def get_headshot_percentage(self):
-        return float(self.headshots) / (self.headshots + self.bodyshots + self.legshots)
 
-    def get_kd(self):
-        if self.deaths != 0:
-            return float(self.kills) / self.deaths
-        else:
-            return self.kills
-
-    def get_kda(self):
-        if self.deaths != 0:
-            return float(self.kills + self.assists) / self.deaths
-        else:
-            return self.kills + self.assists
-
-    def get_kda_string(self):
-        return f'{self.kills}-{self.deaths}-{self.assists}'
-
-    def get_agent_emoji(self):
-        agent_emojis = {
-            "astra": "<:astra:1302748669170159636>",
-            "breach": "<:breach:1302748702045376584>",
-            "brimstone": "<:brimstone:1302748741333286944>",
-            "chamber": "<:chamber:1302748772454895667>",
-            "clove": "<:clove:1302748809352314924>",
-            "cypher": "<:cypher:1302748834111422505>",
-            "deadlock": "<:deadlock:1302748861172813914>",
-            "fade": "<:fade:1302748892001206283>",
-            "gekko": "<:gekko:1302748919708782703>",
-            "harbor": "<:harbor:1302748955263897640>",
-            "iso": "<:iso:1302748985488048191>",
-            "jett": "<:jett:1302749011337543731>",
-            "kay/o": "<:kayo:1302749040861253642>",
-            "killjoy": "<:killjoy:1302749085161492531>",
-            "neon": "<:neon:1302749111942123570>",
-            "omen": "<:omen:1302749144661758032>",
-            "phoenix": "<:phoenix:1302749172042301480>",
-            "raze": "<:raze:1302749193160626176>",
-            "reyna": "<:reyna:1302749217248383036>",
-            "sage": "<:sage:1302749239331389460>",
-            "skye": "<:skye:1302749261720588349>",
-            "sova": "<:sova:1302749294113067038>",
-            "viper": "<:viper:1302749317748232273>",
-            "vyse": "<:vyse:1302750003609075733>",
-            "yoru": "<:yoru:1302749345845870643>"
-        }
-
-        return agent_emojis.get(self.agent_name, "")  # Return empty string if agent not found
-
-class comp_match():
-    def __init__(self, map_name, server, match_id, blue_score, red_score, who_won, match_players, lookup_team, lookup_player, start_date: datetime, end_date: datetime):
-        self.map_name = map_name
-        self.server = server
-        self.match_id = match_id
-        self.blue_score = int(blue_score)
-        self.red_score = int(red_score)
-        self.match_players = match_players
-        self.lookup_team = lookup_team
-        self.lookup_player = lookup_player
-        self.start_date = start_date
-        self.end_date = end_date
-        if who_won == 'Blue':
-            self.winner = 'Blue'
-        elif who_won == 'Red':
-            self.winner = 'Red'
-        else:
-            self.winner = 'Tie'
-
-    def get_score(self):
-        if self.lookup_team == 'Blue':
-            return f'{self.blue_score}-{self.red_score}'
-        else:
-            return f'{self.red_score}-{self.blue_score}'
-
-    def get_formatted_map(self):
-        formatted_map = []
-        start_date_timestamp = int(self.start_date.timestamp())
-        end_date_timestamp = int(self.end_date.timestamp())
-        formatted_map.append(f'**{self.map_name} | {self.get_score()} | <t:{start_date_timestamp}:d><t:{start_date_timestamp}:t> - <t:{end_date_timestamp}:d><t:{end_date_timestamp}:t>**')
-
-        # Sort players by team and KDA within each team
-        blue_team = [player for player in self.match_players if player.team_id == 'Blue']
-        red_team = [player for player in self.match_players if player.team_id == 'Red']
-
-        blue_team.sort(key=lambda x: x.score / (self.blue_score + self.red_score), reverse=True)
-        red_team.sort(key=lambda x: x.score / (self.blue_score + self.red_score), reverse=True)
-
-        formatted_str = ""
-        for team in [blue_team, red_team]:
-            for player in team:
-                if player.get_full_tag().lower() == self.lookup_player.lower():
-                    formatted_str += f'**{get_team_emoji(player.team_id)}{player.get_agent_emoji()} | {player.get_full_tag()} | ACS: {player.score / (self.blue_score + self.red_score):.1f} | KDA: {player.get_kda_string()} | HS%: {player.get_headshot_percentage() * 100:.1f}%**\n'
-                else:
-                    formatted_str += f'{get_team_emoji(player.team_id)}{player.get_agent_emoji()} | {player.get_full_tag()} | ACS: {player.score / (self.blue_score + self.red_score):.1f} | KDA: {player.get_kda_string()} | HS%: {player.get_headshot_percentage() * 100:.1f}%\n'
-
-        formatted_str += f'Server: {self.server}\n'
-        formatted_map.append(formatted_str)
-        return formatted_map
-        
\ No newline at end of file
+# build the cached account from a Players document
+def get_account_from_player(player_doc: dict) -> dict:
+    return {
+        'puuid': player_doc['puuid'],
+        'region': player_doc['region'],
+        'account_level': int(player_doc['account_level']),
+        'title': player_doc.get('title'),
+        'card': player_doc.get('card'),
+        'updated_at': player_doc['last_updated']
+    }
+
+# build a comp_rr_history entry from a v1 mmr history game
+def get_rr_history_entry(match: dict) -> dict:
+    return {
+        'match_id': match['match_id'],
+        'map': match['map']['name'],
+        'mmr_change': int(match['mmr_change_to_last_game']),
+        'date': datetime.fromtimestamp(int(match['date_raw'])),
+        'rank': match['currenttierpatched'],
+        'current_mmr': match['ranking_in_tier'],
+        'rank_image_url': match['images']['small']
+    }
+
+# parse a Match_Data document into a comp_match that isn't tied to a lookup player
+def get_parsed_match(match_data: dict) -> comp_match:
+    match_players = []
+    for player_data in match_data["match_players"]:
+        match_player_obj = match_player(player_data["name"], player_data["tag"], player_data["team_id"], player_data["agent"], player_data["kills"], player_data["deaths"], player_data["score"], player_data["assists"], player_data["headshots"], player_data["bodyshots"], player_data["legshots"], player_data["ability_casts"]["grenade"], player_data["ability_casts"]["ability1"], player_data["ability_casts"]["ability2"], player_data["ability_casts"]["ultimate"], player_data["tier"])
+        match_players.append(match_player_obj)
+    return comp_match(match_data['map_name'], match_data['server'], match_data['match_id'], match_data['blue_score'], match_data['red_score'], match_data.get('who_won'), match_players, None, None, match_data['start_date'], match_data['end_date'])
+
+# the parsed match as seen by the looked up player, sharing its players with the parsed match
+def get_player_match(match: comp_match, player: str) -> comp_match:
+    lookup_team = None
+    for match_player_obj in match.match_players:
+        if match_player_obj.get_full_tag().lower() == str(player).lower():
+            lookup_team = match_player_obj.team_id
+    return comp_match(match.map_name, match.server, match.match_id, match.blue_score, match.red_score, match.winner, match.match_players, lookup_team, player, match.start_date, match.end_date)
+
+# rough memory used by a parsed match, for the size bounded cache
+def get_parsed_match_size(match: comp_match) -> int:
+    return 1024 + 768 * len(match.match_players)
+
+def format_latency(seconds: float) -> str:
+    if seconds == float('inf'):
+        return '>30s'
+    return f'{seconds * 1000:.0f}ms' if seconds < 1 else f'{seconds:g}s'
+
+# count, p50 and p95 (histogram bucket bounds) per label, slowest total time first
+def get_latency_lines(series: dict, errors: dict, label: str, limit: int = 25) -> str:
+    lines = []
+    for label_key, values in sorted(series.items(), key=lambda item: item[1].sum, reverse=True)[:limit]:
+        name = dict(label_key).get(label, '?')
+        line = f'**{name}** | {values.count} | p50 ≤{format_latency(values.get_quantile(0.5))} | p95 ≤{format_latency(values.get_quantile(0.95))}'
+        if errors.get(label_key, 0) > 0:
+            line += f' | {errors[label_key]:g} errors'
+        lines.append(line)
+    return '\n'.join(lines)
+
+def get_http_lines(series: dict, requests: dict) -> str:
+    statuses = {}
+    for label_key, count in requests.items():
+        labels = dict(label_key)
+        statuses.setdefault(labels['endpoint'], []).append(f'{labels["status"]}×{count:g}')
+    lines = []
+    for label_key, values in sorted(series.items(), key=lambda item: item[1].sum, reverse=True):
+        endpoint = dict(label_key)['endpoint']
+        lines.append(f'**{endpoint}** | {", ".join(sorted(statuses.get(endpoint, [])))} | p95 ≤{format_latency(values.get_quantile(0.95))}')
+    return '\n'.join(lines)
+
+def get_cache_lines(counters: dict) -> str:
+    lines = []
+    for label_key, hits in counters.get('cache_hits_total', {}).items():
+        misses = counters.get('cache_misses_total', {}).get(label_key, 0)
+        stale_hits = counters.get('cache_stale_hits_total', {}).get(label_key, 0)
+        lookups = hits + stale_hits + misses
+        hit_rate = f'{(hits + stale_hits) / lookups * 100:.1f}%' if lookups > 0 else '-'
+        lines.append(f'**{dict(label_key)["cache"]}** | {hit_rate} hits of {lookups:g}')
+    return '\n'.join(lines)
+
+def get_in_flight_lines(gauges: dict) -> str:
+    lines = []
+    for name in ['command_in_flight', 'http_request_in_flight', 'mongo_operation_in_flight', 'single_flight_in_flight', 'rate_limiter_queued']:
+        total = sum(gauges.get(name, {}).values())
+        lines.append(f'{name.replace("_in_flight", "").replace("_", " ")}: {total:g}')
+    return ' | '.join(lines)
+
+# loop lag percentiles and the call sites that blocked the loop most often (needs LOOP_WATCHDOG_THRESHOLD)
+def get_stall_lines(lag: dict, stalls: dict, limit: int = 5) -> str:
+    if len(lag) == 0:
+        return 'watchdog off'
+    lines = [f'lag p50 ≤{format_latency(values.get_quantile(0.5))} | p99 ≤{format_latency(values.get_quantile(0.99))}' for values in lag.values()]
+    for label_key, count in sorted(stalls.items(), key=lambda item: item[1], reverse=True)[:limit]:
+        labels = dict(label_key)
+        lines.append(f'**{labels["site"]}** ({labels["command"]}) | {count:g}')
+    return '\n'.join(lines)
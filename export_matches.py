@@ -0,0 +1,43 @@
+from pymongo.mongo_client import MongoClient
+
+import os
+import argparse
+import time
+from dotenv import load_dotenv
+
+from utils.snapshot import export_snapshot, load_watermark, OVERLAP_SECONDS
+
+# Exports matches.Match_Data to parquet for the analytics (pyspark_test.py --source snapshot), so they
+# read columnar files instead of pulling the whole collection out of Mongo every run.
+# Each run only appends documents inserted since the previous one, run it from cron or by hand
+# before an analysis. Use --full to rebuild from scratch, e.g. after repairing old documents.
+
+load_dotenv()
+uri = os.getenv('MONGODB_URI')
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'data/snapshots/matches')
+
+def main():
+    parser = argparse.ArgumentParser(description='Export Match_Data to partitioned parquet files')
+    parser.add_argument('--path', default=SNAPSHOT_PATH, help='snapshot directory')
+    parser.add_argument('--partition-by', choices=['map', 'date'], default='map', help='partition by map name or by month the match started')
+    parser.add_argument('--batch-size', type=int, default=5000, help='matches per parquet file')
+    parser.add_argument('--full', action='store_true', help='delete the snapshot and export everything again')
+    parser.add_argument('--overlap', type=float, default=OVERLAP_SECONDS, help='seconds of _ids behind the watermark read again for late commits')
+    args = parser.parse_args()
+
+    mongo = MongoClient(uri)
+    watermark = load_watermark(args.path)
+    if watermark != None and not args.full:
+        print(f'[Export] appending to {args.path}: {watermark["matches"]} matches, {watermark["players"]} players so far')
+    else:
+        print(f'[Export] writing a new snapshot to {args.path}')
+
+    start_time = time.time()
+    def on_progress(matches: int, players: int):
+        print(f'[Export] {matches} matches, {players} players ({time.time() - start_time:.1f}s)')
+
+    matches, players = export_snapshot(mongo['matches'].Match_Data, args.path, args.partition_by, args.batch_size, args.full, on_progress, args.overlap)
+    print(f'[Export] exported {matches} new matches and {players} player rows in {time.time() - start_time:.1f}s')
+
+if __name__ == '__main__':
+    main()
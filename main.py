@@ -1,6 +1,10 @@
 # the os module helps us access environment variables
 # i.e., our API keys
 import os
+import sys
+import json
+import time
+import urllib.request
 from dotenv import load_dotenv
 
 # the Discord Python API
@@ -11,47 +15,206 @@ from nextcord.ext import commands
 import asyncio
 import nest_asyncio
 
+# multiple processes, each running some of the shards
+import multiprocessing
+
+from utils.ratelimit import create_shared_state
+
 nest_asyncio.apply()
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
-intents = discord.Intents.default()
-intents.message_content = True
-client = commands.Bot(command_prefix='$', intents=intents)
-
-GUILD_IDS = (
-    [int(guild_id) for guild_id in client.guilds]
-    if client.guilds
-    else discord.utils.MISSING
-)  
-    
-@client.event
-async def on_ready():
-    print('------')
-    print(f'Logged in as {client.user.name}')
-    print(client.user.id)
-    print(f'In {len(client.guilds)} servers')
-    print(f'{[guild.name for guild in client.guilds]}')
-    print('------')
-    
-    await client.change_presence(activity=None)
-    
-async def change_status():
+# total number of shards, 0 uses the number discord recommends for our guild count
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 0))
+# processes the shards are split over, each owns a contiguous range of them. 1 runs everything in this process
+CLUSTER_COUNT = int(os.getenv('CLUSTER_COUNT', 1))
+# seconds between checks for guild count changes in other clusters, changes in this one show up right away
+STATUS_INTERVAL = float(os.getenv('STATUS_INTERVAL', 5 * 60))
+# seconds discord wants between two shards identifying in the same concurrency bucket
+IDENTIFY_INTERVAL = 5
+# a crashed cluster is restarted after CLUSTER_RESTART_DELAY seconds, doubling with every crash in a row up to
+# CLUSTER_MAX_RESTART_DELAY. after CLUSTER_MAX_RESTARTS crashes in a row the launcher gives up, since every
+# restart identifies again and spends the daily session start limit
+CLUSTER_RESTART_DELAY = float(os.getenv('CLUSTER_RESTART_DELAY', 5))
+CLUSTER_MAX_RESTART_DELAY = float(os.getenv('CLUSTER_MAX_RESTART_DELAY', 5 * 60))
+CLUSTER_MAX_RESTARTS = int(os.getenv('CLUSTER_MAX_RESTARTS', 5))
+# a cluster that ran this long before crashing starts counting its crashes from zero again
+CLUSTER_STABLE_AFTER = 10 * 60
+# exit code of a cluster that can't log in (bad token, missing intents, invalid shard setup), restarting won't help
+EXIT_CONFIG_ERROR = 78
+# gateway close codes for authentication failed, invalid shard, sharding required, invalid and disallowed intents
+CONFIG_CLOSE_CODES = (4004, 4010, 4011, 4013, 4014)
+
+# shard count and identify concurrency discord recommends for the bot
+def get_gateway_info() -> tuple:
+    request = urllib.request.Request('https://discord.com/api/v10/gateway/bot', headers={'Authorization': f'Bot {TOKEN}', 'User-Agent': 'DiscordBot (discord-bot-v2, 1.0)'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        gateway = json.load(response)
+    return gateway['shards'], gateway['session_start_limit']['max_concurrency']
+
+# contiguous shard ranges, the first clusters get one more shard when they don't divide evenly
+def get_shard_ranges(shard_count: int, cluster_count: int) -> list:
+    size, extra = divmod(shard_count, cluster_count)
+    shard_ranges = []
+    start = 0
+    for cluster_id in range(cluster_count):
+        end = start + size + (1 if cluster_id < extra else 0)
+        shard_ranges.append(list(range(start, end)))
+        start = end
+    return shard_ranges
+
+# guild_counts and henrik_rate_state are shared memory from the launcher in cluster mode, None otherwise
+def create_client(shard_count: int = None, shard_ids: list = None, cluster_id: int = 0, guild_counts = None, henrik_rate_state = None) -> commands.AutoShardedBot:
+    intents = discord.Intents.default()
+    intents.message_content = True
+    client = commands.AutoShardedBot(command_prefix='$', intents=intents, shard_count=shard_count, shard_ids=shard_ids)
+    # read by the cogs
+    client.cluster_id = cluster_id
+    client.henrik_rate_state = henrik_rate_state
+    client.guild_counts = guild_counts
+    client.guilds_changed = asyncio.Event()
+
+    @client.event
+    async def on_ready():
+        print('------')
+        print(f'Logged in as {client.user.name}')
+        print(client.user.id)
+        print(f'Cluster {cluster_id}, shards {sorted(client.shards)} of {client.shard_count}')
+        print(f'In {len(client.guilds)} servers')
+        print('------')
+        client.guilds_changed.set()
+
+    @client.event
+    async def on_guild_join(guild):
+        client.guilds_changed.set()
+
+    @client.event
+    async def on_guild_remove(guild):
+        client.guilds_changed.set()
+
+    return client
+
+# publishes this cluster's guild count and returns the total over all clusters
+def get_guild_count(client: commands.AutoShardedBot) -> int:
+    if client.guild_counts == None:
+        return len(client.guilds)
+    client.guild_counts[client.cluster_id] = len(client.guilds)
+    return sum(client.guild_counts)
+
+# only changes the presence when the total guild count did, other clusters' changes are picked up every STATUS_INTERVAL
+async def change_status(client: commands.AutoShardedBot):
     await client.wait_until_ready()
+    shown_count = None
     while not client.is_closed():
-        await client.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name=f' {len(client.guilds)} servers'), status=discord.Status.dnd)   
-        await asyncio.sleep(10)
+        client.guilds_changed.clear()
+        guild_count = get_guild_count(client)
+        if guild_count != shown_count:
+            await client.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name=f' {guild_count} servers'), status=discord.Status.dnd)
+            shown_count = guild_count
+        try:
+            await asyncio.wait_for(client.guilds_changed.wait(), timeout=STATUS_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
 
-async def load():
+async def load(client: commands.AutoShardedBot):
     for filename in os.listdir('./cogs'):
         if filename.endswith('.py'):
             client.load_extension(f'cogs.{filename[:-3]}')
 
-async def main():
-    await load()
-    client.loop.create_task(change_status())
+async def main(client: commands.AutoShardedBot):
+    await load(client)
+    client.loop.create_task(change_status(client))
     client.run(TOKEN)
 
+# entry point of a cluster process
+def run_cluster(cluster_id: int, shard_ids: list, shard_count: int, guild_counts, henrik_rate_state):
+    client = create_client(shard_count, shard_ids, cluster_id, guild_counts, henrik_rate_state)
+    try:
+        asyncio.run(main(client))
+    except (discord.LoginFailure, discord.PrivilegedIntentsRequired) as e:
+        print(f'[Cluster] cluster {cluster_id} could not log in: {e}')
+        sys.exit(EXIT_CONFIG_ERROR)
+    except discord.ConnectionClosed as e:
+        if e.code not in CONFIG_CLOSE_CODES:
+            raise
+        print(f'[Cluster] cluster {cluster_id} was disconnected with close code {e.code}: {e}')
+        sys.exit(EXIT_CONFIG_ERROR)
+
+def start_cluster(context, cluster_id: int, shard_ids: list, shard_count: int, guild_counts, henrik_rate_state):
+    process = context.Process(target=run_cluster, args=(cluster_id, shard_ids, shard_count, guild_counts, henrik_rate_state), name=f'cluster-{cluster_id}')
+    process.start()
+    print(f'[Cluster] started cluster {cluster_id} (pid {process.pid}) with shards {shard_ids[0]}-{shard_ids[-1]}')
+    return process
+
+def get_restart_delay(crashes: int) -> float:
+    return min(CLUSTER_MAX_RESTART_DELAY, CLUSTER_RESTART_DELAY * 2 ** (crashes - 1))
+
+# starts the clusters one after another so their shards don't identify at the same time, then restarts
+# any that crash (with backoff) until all of them exited cleanly. stops everything when a cluster can't
+# log in, crashes too often in a row, or we are interrupted. returns the exit code for the launcher
+def run_clusters() -> int:
+    shard_count, max_concurrency = SHARD_COUNT, 1
+    if shard_count <= 0:
+        shard_count, max_concurrency = get_gateway_info()
+    cluster_count = min(CLUSTER_COUNT, shard_count)
+    shard_ranges = get_shard_ranges(shard_count, cluster_count)
+    print(f'[Cluster] running {shard_count} shards in {cluster_count} clusters')
+
+    context = multiprocessing.get_context('spawn')
+    guild_counts = context.Array('i', cluster_count)
+    henrik_rate_state = create_shared_state(context)
+    processes = []
+    # per cluster: when it was last started, crashes in a row, and when it is due to be restarted (None when it runs or exited cleanly)
+    started_at = []
+    crashes = [0] * cluster_count
+    restart_at = [None] * cluster_count
+    try:
+        for cluster_id, shard_ids in enumerate(shard_ranges):
+            processes.append(start_cluster(context, cluster_id, shard_ids, shard_count, guild_counts, henrik_rate_state))
+            started_at.append(time.monotonic())
+            if cluster_id < cluster_count - 1:
+                time.sleep(IDENTIFY_INTERVAL * len(shard_ids) / max_concurrency)
+
+        while any(process.exitcode != 0 for process in processes):
+            time.sleep(1)
+            now = time.monotonic()
+            for cluster_id, process in enumerate(processes):
+                if restart_at[cluster_id] != None:
+                    if now >= restart_at[cluster_id]:
+                        restart_at[cluster_id] = None
+                        processes[cluster_id] = start_cluster(context, cluster_id, shard_ranges[cluster_id], shard_count, guild_counts, henrik_rate_state)
+                        started_at[cluster_id] = now
+                    continue
+                if process.exitcode in (None, 0):
+                    continue
+
+                guild_counts[cluster_id] = 0
+                if process.exitcode == EXIT_CONFIG_ERROR:
+                    print(f'[Cluster] cluster {cluster_id} could not log in, check DISCORD_TOKEN, the intents and SHARD_COUNT. stopping')
+                    return EXIT_CONFIG_ERROR
+                if now - started_at[cluster_id] >= CLUSTER_STABLE_AFTER:
+                    crashes[cluster_id] = 0
+                crashes[cluster_id] += 1
+                if crashes[cluster_id] > CLUSTER_MAX_RESTARTS:
+                    print(f'[Cluster] cluster {cluster_id} crashed {crashes[cluster_id]} times in a row (last exit code {process.exitcode}), stopping')
+                    return 1
+                delay = get_restart_delay(crashes[cluster_id])
+                print(f'[Cluster] cluster {cluster_id} exited with code {process.exitcode}, restarting it in {delay:g}s ({crashes[cluster_id]}/{CLUSTER_MAX_RESTARTS})')
+                restart_at[cluster_id] = now + delay
+        return 0
+    except KeyboardInterrupt:
+        print('[Cluster] stopping')
+        return 0
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    if CLUSTER_COUNT > 1:
+        sys.exit(run_clusters())
+    else:
+        asyncio.run(main(create_client(SHARD_COUNT or None)))
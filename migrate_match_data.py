@@ -0,0 +1,88 @@
+from pymongo.mongo_client import MongoClient
+from pymongo import UpdateOne, ASCENDING
+
+import os
+import argparse
+import time
+from collections import Counter
+from dotenv import load_dotenv
+
+from utils.parser import SCHEMA_VERSION, normalize_match_document
+
+# Brings every matches.Match_Data document to the current schema (utils/parser.py SCHEMA_VERSION):
+# ability casts saved as strings like '{grenade=3, ability1=2, ...}' become dicts, numbers saved as
+# strings become ints, agents are lowercased, NaN who_won values are removed (backfill_matches.py
+# downloads those matches again) and schema_version is set. The placeholder rows older versions
+# inserted to create the databases are deleted.
+# Documents already at the current version are not touched, so it is safe to run again.
+
+load_dotenv()
+uri = os.getenv('MONGODB_URI')
+
+SEED_QUERIES = [
+    ('matches', 'Match_Data', {'match_id': ''}),
+    ('players', 'Players', {'puuid': ''})
+]
+
+def main():
+    parser = argparse.ArgumentParser(description='Normalize Match_Data documents to the current schema')
+    parser.add_argument('--batch-size', type=int, default=500, help='documents per bulk write')
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing anything')
+    args = parser.parse_args()
+
+    mongo = MongoClient(uri)
+    collection = mongo['matches'].Match_Data
+    start_time = time.time()
+
+    for database, collection_name, query in SEED_QUERIES:
+        seed_collection = mongo[database][collection_name]
+        if args.dry_run:
+            removed = seed_collection.count_documents(query)
+        else:
+            removed = seed_collection.delete_many(query).deleted_count
+        print(f'[Migrate] {"would remove" if args.dry_run else "removed"} {removed} placeholder rows from {database}.{collection_name}')
+
+    query = {'schema_version': {'$ne': SCHEMA_VERSION}}
+    total = collection.count_documents(query)
+    print(f'[Migrate] {total} documents are not at schema version {SCHEMA_VERSION}')
+
+    changes = Counter()
+    scanned = 0
+    operations = []
+    def write():
+        if operations and not args.dry_run:
+            collection.bulk_write(operations, ordered=False)
+        operations.clear()
+
+    for match_data in collection.find(query).sort('_id', ASCENDING):
+        update, document_changes = normalize_match_document(match_data)
+        changes.update(document_changes)
+        if document_changes:
+            changes['rewritten'] += 1
+        if not match_data.get('match_players'):
+            changes['no_match_players'] += 1
+        operations.append(UpdateOne({'_id': match_data['_id']}, update))
+        scanned += 1
+        if len(operations) >= args.batch_size:
+            write()
+            print(f'[Migrate] ({scanned}/{total}) {time.time() - start_time:.1f}s')
+    write()
+
+    print(f'[Migrate] {"would update" if args.dry_run else "updated"} {scanned} documents in {time.time() - start_time:.1f}s, '
+          f'{changes["rewritten"]} of them {"would be" if args.dry_run else "were"} rewritten, the rest only {"get" if args.dry_run else "got"} the schema version')
+    # a document can be counted for several reasons
+    descriptions = {
+        'ability_casts': 'had ability casts saved as a string or missing',
+        'ability_cast_values': 'had ability cast counts that were None, missing or not ints',
+        'player_stats': 'had player stats that were not ints',
+        'scores': 'had team scores that were not ints',
+        'agent': 'had agent names that were not lowercase',
+        'who_won': 'had an invalid who_won, run backfill_matches.py to download them again',
+        'no_match_players': 'have no match_players and only got the schema version'
+    }
+    for change, description in descriptions.items():
+        if changes[change] > 0:
+            print(f'[Migrate]   {changes[change]} {description}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+from pymongo.mongo_client import MongoClient
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+
+import os
+import re
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+# Moves the old per player databases (one database per puuid with a comp_rr_history collection)
+# into the single players.comp_rr_history collection the bot reads from.
+# Safe to run while the bot is online and to run again after a crash: every game is upserted on
+# (puuid, match_id), so games the bot already saved or that were copied before are left alone.
+
+load_dotenv()
+uri = os.getenv('MONGODB_URI')
+
+PUUID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+def get_legacy_puuids(mongo: MongoClient) -> list:
+    return [name for name in mongo.list_database_names() if PUUID_PATTERN.match(name)]
+
+def migrate_player(mongo: MongoClient, puuid: str, batch_size: int, drop: bool, dry_run: bool) -> int:
+    legacy_history = mongo[puuid].comp_rr_history
+    target = mongo['players'].comp_rr_history
+
+    copied = 0
+    operations = []
+    for entry in legacy_history.find({}, {'_id': 0}):
+        entry['puuid'] = puuid
+        operations.append(UpdateOne({'puuid': puuid, 'match_id': entry['match_id']}, {'$setOnInsert': entry}, upsert=True))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                target.bulk_write(operations, ordered=False)
+            copied += len(operations)
+            operations = []
+    if operations:
+        if not dry_run:
+            target.bulk_write(operations, ordered=False)
+        copied += len(operations)
+
+    if drop and not dry_run:
+        # only drop the old database once every game in it is in the new collection
+        legacy_ids = set(legacy_history.distinct('match_id'))
+        migrated_ids = set(target.distinct('match_id', {'puuid': puuid}))
+        if legacy_ids <= migrated_ids:
+            mongo.drop_database(puuid)
+        else:
+            print(f'[Migrate] {puuid} is missing {len(legacy_ids - migrated_ids)} games after copying, keeping the old database')
+    return copied
+
+def main():
+    parser = argparse.ArgumentParser(description='Move per puuid comp_rr_history databases into players.comp_rr_history')
+    parser.add_argument('--workers', type=int, default=4, help='players migrated at the same time')
+    parser.add_argument('--batch-size', type=int, default=500, help='games per bulk write')
+    parser.add_argument('--drop', action='store_true', help='drop each old database after it is copied')
+    parser.add_argument('--dry-run', action='store_true', help='count what would be copied without writing anything')
+    args = parser.parse_args()
+
+    mongo = MongoClient(uri)
+    target = mongo['players'].comp_rr_history
+    if not args.dry_run:
+        target.create_index([('puuid', ASCENDING), ('date', DESCENDING)])
+        target.create_index([('puuid', ASCENDING), ('match_id', ASCENDING)], unique=True)
+
+    puuids = get_legacy_puuids(mongo)
+    total_players = len(puuids)
+    print(f'[Migrate] found {total_players} player databases')
+
+    start_time = time.time()
+    total_games = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(migrate_player, mongo, puuid, args.batch_size, args.drop, args.dry_run): puuid for puuid in puuids}
+        for count, future in enumerate(as_completed(futures), start=1):
+            puuid = futures[future]
+            try:
+                games = future.result()
+                total_games += games
+                print(f'[Migrate] ({count}/{total_players}) {puuid}: {games} games')
+            except Exception as e:
+                failed.append(puuid)
+                print(f'[Migrate] ({count}/{total_players}) {puuid} failed: {e}')
+
+    print(f'[Migrate] {"would copy" if args.dry_run else "copied"} {total_games} games from {total_players - len(failed)} players in {time.time() - start_time:.1f}s')
+    if failed:
+        print(f'[Migrate] {len(failed)} players failed, run the migration again to retry them')
+
+if __name__ == '__main__':
+    main()
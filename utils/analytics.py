@@ -0,0 +1,70 @@
+import os
+
+import pandas as pd
+
+from utils.models import iter_match_batches
+from utils.snapshot import read_snapshot_table
+
+# one row per player per match: rounds played in the match, kills per round and the agent played
+KILL_RATIO_COLUMNS = ['total_rounds_played', 'player_kill_ratio', 'agent']
+
+# only the fields the analytics read, so the database doesn't send round data etc. we ignore anyway
+MATCH_PROJECTION = {'_id': 0, 'match_id': 1, 'map_name': 1, 'server': 1, 'blue_score': 1, 'red_score': 1, 'who_won': 1, 'match_players': 1}
+
+# local mode: a single pass over Match_Data documents (a list or a cursor) with numpy doing the math,
+# matches without players (the seed row) or without any rounds played are skipped
+def get_kill_ratios(documents, batch_size: int = 10000) -> pd.DataFrame:
+    frames = []
+    for batch in iter_match_batches(documents, batch_size):
+        rounds_played = batch.get_rounds_played()
+        played = rounds_played > 0
+        frames.append(pd.DataFrame({
+            'total_rounds_played': rounds_played[played],
+            'player_kill_ratio': batch.get_kills_per_round()[played],
+            'agent': batch.get_agent_names()[played]
+        }))
+
+    if not frames:
+        return pd.DataFrame(columns=KILL_RATIO_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+# spark mode: the same rows as get_kill_ratios as one lazy plan, match_players is exploded once
+# instead of filtering the dataframe per match
+def get_kill_ratios_spark(matches_sdf):
+    from pyspark.sql import functions as F
+
+    total_rounds_played = F.col('red_score').cast('int') + F.col('blue_score').cast('int')
+    return (
+        matches_sdf
+        .where(F.col('match_players').isNotNull())
+        .select(total_rounds_played.alias('total_rounds_played'), F.explode('match_players').alias('player'))
+        .where(F.col('total_rounds_played') > 0)
+        .select(
+            'total_rounds_played',
+            (F.col('player')['kills'].cast('double') / F.col('total_rounds_played')).alias('player_kill_ratio'),
+            F.col('player')['agent'].alias('agent')
+        )
+    )
+
+# the same rows read from a parquet snapshot (see utils/snapshot.py) instead of Mongo, filters are pushed
+# down to the files, e.g. [('map_name', '=', 'Ascent')] only opens the Ascent partition
+def get_kill_ratios_snapshot(path: str, filters: list = None) -> pd.DataFrame:
+    players = read_snapshot_table(path, 'players', columns=['rounds_played', 'kills', 'agent'], filters=[('rounds_played', '>', 0)] + (filters or [])).to_pandas()
+    return pd.DataFrame({
+        'total_rounds_played': players['rounds_played'],
+        'player_kill_ratio': players['kills'] / players['rounds_played'],
+        'agent': players['agent']
+    })
+
+def get_kill_ratios_spark_snapshot(spark, path: str):
+    from pyspark.sql import functions as F
+
+    return (
+        spark.read.parquet(os.path.join(path, 'players'))
+        .where(F.col('rounds_played') > 0)
+        .select(
+            F.col('rounds_played').alias('total_rounds_played'),
+            (F.col('kills') / F.col('rounds_played')).alias('player_kill_ratio'),
+            'agent'
+        )
+    )
@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+
+# small in-process cache where entries go stale after ttl seconds but are still returned,
+# so callers can answer right away and refresh in the background
+class ttl_cache():
+    def __init__(self, ttl: float, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    # returns (value, is_stale), value is None on a miss
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+
+        value, stored_at = entry
+        self.entries.move_to_end(key)
+        if time.time() - stored_at > self.ttl:
+            self.stale_hits += 1
+            return value, True
+        self.hits += 1
+        return value, False
+
+    # stored_at is a unix timestamp, so entries loaded from the database keep their real age
+    def set(self, key, value, stored_at: float = None):
+        self.entries[key] = (value, stored_at if stored_at != None else time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {'size': len(self.entries), 'hits': self.hits, 'stale_hits': self.stale_hits, 'misses': self.misses}
+
+# least recently used cache bounded by the total size of its values rather than how many there are,
+# get_size(value) returns the (approximate) size of one value
+class lru_cache():
+    def __init__(self, max_size: int, get_size=None):
+        self.max_size = max_size
+        self.get_size = get_size if get_size != None else (lambda value: 1)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        size = self.get_size(value)
+        if size > self.max_size:
+            return
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry != None:
+            self.size -= entry[1]
+
+    def stats(self) -> dict:
+        return {'entries': len(self.entries), 'size': self.size, 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import os
+
+from utils.http import api_client
+
+CONTENT_API_URL = 'https://valorant-api.com/v1'
+
+# titles and cards are static game content, so they are downloaded once from
+# valorant-api.com, kept in memory and on disk, and only downloaded again when the game version changes
+class content_catalog():
+    def __init__(self, path: str, http: api_client):
+        self.path = path
+        self.http = http
+        self.version = None
+        self.titles = {}
+        self.cards = {}
+
+    def load_from_disk(self) -> bool:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                catalog = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        self.version = catalog.get('version')
+        self.titles = catalog.get('titles', {})
+        self.cards = catalog.get('cards', {})
+        return True
+
+    def save_to_disk(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # write to a temp file first so a crash never leaves a half written catalog behind
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'titles': self.titles, 'cards': self.cards}, f)
+        os.replace(temp_path, self.path)
+
+    async def get_remote_version(self) -> str:
+        status, data = await self.http.get_json(f'{CONTENT_API_URL}/version')
+        if status != 200:
+            return None
+        return data['data']['version']
+
+    # returns True if the catalog was downloaded again
+    async def refresh(self, force: bool = False) -> bool:
+        version = await self.get_remote_version()
+        if version == None or (version == self.version and not force):
+            return False
+
+        (titles_status, titles), (cards_status, cards) = await asyncio.gather(
+            self.http.get_json(f'{CONTENT_API_URL}/playertitles'),
+            self.http.get_json(f'{CONTENT_API_URL}/playercards')
+        )
+        if titles_status != 200 or cards_status != 200:
+            print(f'[Catalog] could not download content: {titles_status}, {cards_status}')
+            return False
+
+        self.titles = {title['uuid']: title['titleText'] for title in titles['data'] if title.get('titleText')}
+        self.cards = {card['uuid']: card['smallArt'] for card in cards['data']}
+        self.version = version
+        await asyncio.to_thread(self.save_to_disk)
+        print(f'[Catalog] loaded {len(self.titles)} titles and {len(self.cards)} cards for {version}')
+        return True
+
+    def get_title(self, title_id: str) -> str:
+        return self.titles.get(title_id)
+
+    def get_card_url(self, card_id: str) -> str:
+        return self.cards.get(card_id)
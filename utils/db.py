@@ -0,0 +1,144 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.mongo_client import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from utils.stats import STATS_INDEXES
+from utils.metrics import metrics_registry
+
+# pymongo is blocking, so everything the bot sends to mongo is run on a small
+# thread pool instead of on the nextcord event loop
+class mongo_db():
+    def __init__(self, uri, max_workers: int = 8, metrics: metrics_registry = None):
+        self.client = MongoClient(uri)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mongo')
+        self.metrics = metrics if metrics != None else metrics_registry()
+
+    # timed into mongo_operation_seconds, including the wait for a free worker thread
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        with self.metrics.track('mongo_operation', {'operation': get_operation_name(func)}):
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def ping(self):
+        return await self.run(self.client.admin.command, 'ping')
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.client.close()
+
+# e.g. Match_Data.find_one for collection methods, match_repository.find_many for the lambdas the repositories pass
+def get_operation_name(func) -> str:
+    owner = getattr(func, '__self__', None)
+    if isinstance(owner, (Collection, Database)):
+        return f'{owner.name}.{func.__name__}'
+    return getattr(func, '__qualname__', repr(func)).replace('.<locals>.<lambda>', '')
+
+# players are looked up either by puuid or by their lowercased name#tag
+def get_player_key(player: str) -> str:
+    return str(player).lower()
+
+# deletes all but one document for each value of field, keeping the first one in sort order
+def remove_duplicates(collection: Collection, field: str, sort: dict = None) -> int:
+    pipeline = [{'$sort': sort}] if sort != None else []
+    duplicates = collection.aggregate(pipeline + [
+        {'$group': {'_id': f'${field}', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    extra_ids = [object_id for duplicate in duplicates for object_id in duplicate['ids'][1:]]
+    if extra_ids:
+        collection.delete_many({'_id': {'$in': extra_ids}})
+    return len(extra_ids)
+
+class player_repository():
+    def __init__(self, db: mongo_db):
+        self.db = db
+        self.collection = db.client['players'].Players
+
+    async def setup(self):
+        # backfill the lookup key for documents saved before it existed
+        await self.db.run(self.collection.update_many, {'player_key': {'$exists': False}}, [{'$set': {'player_key': {'$toLower': '$player'}}}])
+        try:
+            await self.db.run(self.collection.create_index, 'puuid', unique=True)
+        except OperationFailure:
+            # older versions of the bot could insert the same player twice, keep the most recently updated one
+            removed = await self.db.run(remove_duplicates, self.collection, 'puuid', {'last_updated': -1, '_id': -1})
+            print(f'Removed {removed} duplicate players from Players')
+            await self.db.run(self.collection.create_index, 'puuid', unique=True)
+        await self.db.run(self.collection.create_index, 'player_key')
+
+    async def find_by_name(self, player: str) -> dict:
+        return await self.db.run(self.collection.find_one, {'player_key': get_player_key(player)})
+
+    # insert or update a player, returning the document as it was before the write (None if it is new)
+    async def upsert(self, puuid: str, fields: dict) -> dict:
+        fields = dict(fields)
+        if 'player' in fields:
+            fields['player_key'] = get_player_key(fields['player'])
+        return await self.db.run(self.collection.find_one_and_update, {'puuid': puuid}, {'$set': fields}, upsert=True, return_document=ReturnDocument.BEFORE)
+
+class match_repository():
+    def __init__(self, db: mongo_db):
+        self.db = db
+        self.collection = db.client['matches'].Match_Data
+
+    async def setup(self):
+        try:
+            await self.db.run(self.collection.create_index, 'match_id', unique=True)
+        except OperationFailure:
+            # older versions of the bot could save the same match twice
+            removed = await self.db.run(remove_duplicates, self.collection, 'match_id')
+            print(f'Removed {removed} duplicate matches from Match_Data')
+            await self.db.run(self.collection.create_index, 'match_id', unique=True)
+
+        for keys in STATS_INDEXES:
+            await self.db.run(self.collection.create_index, keys)
+
+    # get the stored matches for the given ids in one query, keyed by match id
+    async def find_many(self, match_ids: list) -> dict:
+        matches = await self.db.run(lambda: list(self.collection.find({'match_id': {'$in': list(match_ids)}})))
+        return {match_data['match_id']: match_data for match_data in matches}
+
+    # run one of the pipelines from utils/stats.py, only the aggregated rows come back
+    async def aggregate(self, pipeline: list) -> list:
+        return await self.db.run(lambda: list(self.collection.aggregate(pipeline, allowDiskUse=True)))
+
+    async def save(self, match_data: dict):
+        try:
+            await self.db.run(self.collection.replace_one, {'match_id': match_data['match_id']}, match_data, upsert=True)
+        except DuplicateKeyError:
+            # another writer upserted the same match first
+            pass
+
+# every player's rr history lives in one collection, indexed so the newest games of a player are a single query
+class rr_history_repository():
+    def __init__(self, db: mongo_db):
+        self.db = db
+        self.collection = db.client['players'].comp_rr_history
+
+    async def setup(self):
+        await self.db.run(self.collection.create_index, [('puuid', ASCENDING), ('date', DESCENDING)])
+        await self.db.run(self.collection.create_index, [('puuid', ASCENDING), ('match_id', ASCENDING)], unique=True)
+
+    # newest games first
+    async def find_latest(self, puuid: str, limit: int) -> list:
+        return await self.db.run(lambda: list(self.collection.find({'puuid': puuid}, {'_id': 0}).sort('date', DESCENDING).limit(limit)))
+
+    # upsert games keyed on (puuid, match_id) in one unordered bulk write, so repeating a sync is harmless
+    async def upsert_many(self, puuid: str, history: list) -> int:
+        operations = [UpdateOne({'puuid': puuid, 'match_id': entry['match_id']}, {'$set': dict(entry, puuid=puuid)}, upsert=True) for entry in history]
+        if len(operations) == 0:
+            return 0
+        try:
+            result = await self.db.run(self.collection.bulk_write, operations, ordered=False)
+            return result.upserted_count
+        except BulkWriteError as e:
+            # two syncs racing to insert the same game, the other one already saved it
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+            return e.details['nUpserted']
@@ -0,0 +1,81 @@
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils.ratelimit import rate_limiter, INTERACTIVE
+from utils.singleflight import single_flight
+from utils.metrics import metrics_registry
+
+# one long lived aiohttp session so requests reuse pooled keep-alive connections
+# instead of doing a new TCP + TLS handshake every call
+class api_client():
+    def __init__(self, total_timeout: float = 15, connect_timeout: float = 5, pool_size: int = 100, pool_size_per_host: int = 20, dns_cache_ttl: int = 300, keepalive_timeout: float = 30, limiters: dict = None, max_retries: int = 3, metrics: metrics_registry = None):
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        # host -> rate_limiter, every request to that host waits for a token first
+        self.limiters = limiters or {}
+        self.max_retries = max_retries
+        self.metrics = metrics if metrics != None else metrics_registry()
+        self.in_flight = single_flight()
+        self.session = None
+
+    # the session is created lazily so it is bound to the running event loop
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size_per_host, ttl_dns_cache=self.dns_cache_ttl, keepalive_timeout=self.keepalive_timeout)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    def get(self, url: str, **kwargs):
+        return self.get_session().get(url, **kwargs)
+
+    def get_limiter(self, url: str) -> rate_limiter:
+        return self.limiters.get(urlsplit(url).hostname)
+
+    # GET a json endpoint, returns (status, json body or None)
+    # concurrent requests for the same url share one response (unless the shared one runs at a lower priority),
+    # so the body must be treated as read only.
+    # endpoint names the request in the metrics (the url's host by default)
+    async def get_json(self, url: str, headers: dict = None, priority: int = INTERACTIVE, endpoint: str = None):
+        return await self.in_flight.do_with_priority(('json', url), priority, self.fetch, url, headers, priority, True, endpoint)
+
+    # same as get_json but returns the raw body, for callers that decode it themselves
+    async def get_bytes(self, url: str, headers: dict = None, priority: int = INTERACTIVE, endpoint: str = None):
+        return await self.in_flight.do_with_priority(('bytes', url), priority, self.fetch, url, headers, priority, False, endpoint)
+
+    # rate limited requests are queued again instead of being returned to the caller.
+    # failed requests (connection errors, timeouts) are counted in http_request_errors_total by track
+    async def fetch(self, url: str, headers: dict = None, priority: int = INTERACTIVE, as_json: bool = True, endpoint: str = None):
+        limiter = self.get_limiter(url)
+        labels = {'endpoint': endpoint or urlsplit(url).hostname}
+        attempt = 0
+        while True:
+            if limiter is not None:
+                queued_at = time.perf_counter()
+                await limiter.acquire(priority)
+                self.metrics.observe('http_rate_limit_wait_seconds', time.perf_counter() - queued_at, labels)
+            with self.metrics.track('http_request', labels):
+                async with self.get(url, headers=headers) as response:
+                    self.metrics.inc('http_requests_total', dict(labels, status=response.status))
+                    if limiter is not None:
+                        limiter.update(response.status, response.headers)
+                    if response.status == 429:
+                        self.metrics.inc('http_rate_limited_total', labels)
+                        if limiter is not None and attempt < self.max_retries:
+                            print(f'[HTTP] rate limited on {url}, queueing retry {attempt + 1}/{self.max_retries}')
+                            attempt += 1
+                            continue
+                    if response.status != 200:
+                        return response.status, None
+                    if as_json:
+                        return response.status, await response.json()
+                    return response.status, await response.read()
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
@@ -0,0 +1,158 @@
+import time
+import functools
+import contextlib
+
+from aiohttp import web
+
+# in-process metrics in the prometheus text format: counters, gauges and histograms with labels.
+# values are only updated from the event loop. collectors are called when the metrics are read,
+# for numbers other objects already keep (cache stats etc.)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def get_label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items())) if labels else ()
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(label_key: tuple, extra: tuple = ()) -> str:
+    pairs = label_key + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+class histogram():
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    # upper bound of the bucket the quantile falls in, inf when it is above the largest bucket
+    def get_quantile(self, quantile: float) -> float:
+        if self.count == 0:
+            return 0
+        target = quantile * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+class metrics_registry():
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+
+    def inc(self, name: str, labels: dict = None, value: float = 1):
+        series = self.counters.setdefault(name, {})
+        key = get_label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, labels: dict = None):
+        self.gauges.setdefault(name, {})[get_label_key(labels)] = value
+
+    def add(self, name: str, value: float, labels: dict = None):
+        series = self.gauges.setdefault(name, {})
+        key = get_label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: dict = None, buckets: tuple = LATENCY_BUCKETS):
+        series = self.histograms.setdefault(name, {})
+        key = get_label_key(labels)
+        if key not in series:
+            series[key] = histogram(buckets)
+        series[key].observe(value)
+
+    # time a block into the <name>_seconds histogram, with a <name>_in_flight gauge while it runs
+    # and <name>_errors_total counting the blocks that raised
+    @contextlib.contextmanager
+    def track(self, name: str, labels: dict = None):
+        self.add(f'{name}_in_flight', 1, labels)
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(f'{name}_errors_total', labels)
+            raise
+        finally:
+            self.observe(f'{name}_seconds', time.perf_counter() - start, labels)
+            self.add(f'{name}_in_flight', -1, labels)
+
+    # collector() returns (name, labels, value, 'counter' or 'gauge') tuples
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def collect(self) -> tuple:
+        counters = {name: dict(series) for name, series in self.counters.items()}
+        gauges = {name: dict(series) for name, series in self.gauges.items()}
+        for collector in self.collectors:
+            for name, labels, value, kind in collector():
+                (counters if kind == 'counter' else gauges).setdefault(name, {})[get_label_key(labels)] = value
+        return counters, gauges
+
+    def render(self) -> str:
+        counters, gauges = self.collect()
+        lines = []
+        for kind, metrics in [('counter', counters), ('gauge', gauges)]:
+            for name in sorted(metrics):
+                lines.append(f'# TYPE {name} {kind}')
+                for label_key, value in metrics[name].items():
+                    lines.append(f'{name}{format_labels(label_key)} {value:g}')
+        for name in sorted(self.histograms):
+            lines.append(f'# TYPE {name} histogram')
+            for label_key, series in self.histograms[name].items():
+                cumulative = 0
+                for bound, count in zip(series.buckets, series.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(label_key, (("le", f"{bound:g}"),))} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(label_key, (("le", "+Inf"),))} {series.count}')
+                lines.append(f'{name}_sum{format_labels(label_key)} {series.sum:g}')
+                lines.append(f'{name}_count{format_labels(label_key)} {series.count}')
+        return '\n'.join(lines) + '\n'
+
+# times a cog's slash command into command_seconds{command=...}, the cog needs a metrics attribute
+def instrument_command(func):
+    @functools.wraps(func)
+    async def wrapper(self, interaction, *args, **kwargs):
+        with self.metrics.track('command', {'command': func.__name__}):
+            return await func(self, interaction, *args, **kwargs)
+    return wrapper
+
+# serves GET /metrics for prometheus, meant to listen on localhost only
+class metrics_server():
+    def __init__(self, registry: metrics_registry, host: str = '127.0.0.1', port: int = 9464):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        print(f'[Metrics] serving http://{self.host}:{self.port}/metrics')
+
+    async def stop(self):
+        if self.runner != None:
+            await self.runner.cleanup()
+            self.runner = None
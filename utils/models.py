@@ -0,0 +1,284 @@
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+AGENT_EMOJIS = {
+    "astra": "<:astra:1302748669170159636>",
+    "breach": "<:breach:1302748702045376584>",
+    "brimstone": "<:brimstone:1302748741333286944>",
+    "chamber": "<:chamber:1302748772454895667>",
+    "clove": "<:clove:1302748809352314924>",
+    "cypher": "<:cypher:1302748834111422505>",
+    "deadlock": "<:deadlock:1302748861172813914>",
+    "fade": "<:fade:1302748892001206283>",
+    "gekko": "<:gekko:1302748919708782703>",
+    "harbor": "<:harbor:1302748955263897640>",
+    "iso": "<:iso:1302748985488048191>",
+    "jett": "<:jett:1302749011337543731>",
+    "kay/o": "<:kayo:1302749040861253642>",
+    "killjoy": "<:killjoy:1302749085161492531>",
+    "neon": "<:neon:1302749111942123570>",
+    "omen": "<:omen:1302749144661758032>",
+    "phoenix": "<:phoenix:1302749172042301480>",
+    "raze": "<:raze:1302749193160626176>",
+    "reyna": "<:reyna:1302749217248383036>",
+    "sage": "<:sage:1302749239331389460>",
+    "skye": "<:skye:1302749261720588349>",
+    "sova": "<:sova:1302749294113067038>",
+    "viper": "<:viper:1302749317748232273>",
+    "vyse": "<:vyse:1302750003609075733>",
+    "yoru": "<:yoru:1302749345845870643>"
+}
+
+TEAMS = ['Blue', 'Red']
+# the values of Match_Data.who_won
+RESULTS = ['Blue', 'Red', 'Tie']
+
+def get_team_emoji(team_name: str) -> str:
+    if team_name == 'Blue':
+        return '🟦'
+    if team_name == 'Red':
+        return '🟥'
+
+# older Match_Data documents store ability casts as a string like '{grenade=3, ability1=2, ...}'
+def parse_ability_casts(ability_casts) -> dict:
+    if isinstance(ability_casts, dict):
+        return ability_casts
+    parsed = {}
+    for element in str(ability_casts).strip('{}').split(','):
+        if '=' not in element:
+            continue
+        key, value = element.strip().split('=', 1)
+        try:
+            parsed[key] = int(value)
+        except ValueError:
+            parsed[key] = 0
+    return parsed
+
+def to_int(value) -> int:
+    return int(value) if value != None else 0
+
+class match_player():
+    __slots__ = ('player_name', 'player_tag', 'team_id', 'agent_name', 'kills', 'deaths', 'score', 'assists', 'headshots', 'bodyshots', 'legshots', 'e_ability', 'c_ability', 'q_ability', 'x_ability', 'rank_in_match')
+
+    def __init__(self, player_name, player_tag, team_id, agent_name, kills, deaths, score, assists, headshots, bodyshots, legshots, e_ability, c_ability, q_ability, x_ability, rank_in_match):
+        self.player_name = player_name
+        self.player_tag = player_tag
+        self.team_id = team_id
+        self.agent_name = agent_name
+        self.kills = int(kills)
+        self.deaths = int(deaths)
+        self.score = int(score)
+        self.assists = int(assists)
+        self.headshots = int(headshots)
+        self.bodyshots = int(bodyshots)
+        self.legshots = int(legshots)
+        self.e_ability = to_int(e_ability)
+        self.c_ability = to_int(c_ability)
+        self.q_ability = to_int(q_ability)
+        self.x_ability = to_int(x_ability)
+        self.rank_in_match = rank_in_match
+
+    def get_full_tag(self):
+        return self.player_name + "#" + self.player_tag
+
+    def get_headshot_percentage(self):
+        return float(self.headshots) / (self.headshots + self.bodyshots + self.legshots)
+
+    def get_kd(self):
+        if self.deaths != 0:
+            return float(self.kills) / self.deaths
+        else:
+            return self.kills
+
+    def get_kda(self):
+        if self.deaths != 0:
+            return float(self.kills + self.assists) / self.deaths
+        else:
+            return self.kills + self.assists
+
+    def get_kda_string(self):
+        return f'{self.kills}-{self.deaths}-{self.assists}'
+
+    def get_agent_emoji(self):
+        return AGENT_EMOJIS.get(self.agent_name, "")  # Return empty string if agent not found
+
+class comp_match():
+    __slots__ = ('map_name', 'server', 'match_id', 'blue_score', 'red_score', 'match_players', 'lookup_team', 'lookup_player', 'start_date', 'end_date', 'winner')
+
+    def __init__(self, map_name, server, match_id, blue_score, red_score, who_won, match_players, lookup_team, lookup_player, start_date: datetime, end_date: datetime):
+        self.map_name = map_name
+        self.server = server
+        self.match_id = match_id
+        self.blue_score = int(blue_score)
+        self.red_score = int(red_score)
+        self.match_players = match_players
+        self.lookup_team = lookup_team
+        self.lookup_player = lookup_player
+        self.start_date = start_date
+        self.end_date = end_date
+        if who_won == 'Blue':
+            self.winner = 'Blue'
+        elif who_won == 'Red':
+            self.winner = 'Red'
+        else:
+            self.winner = 'Tie'
+
+    def get_rounds_played(self):
+        return self.blue_score + self.red_score
+
+    def get_score(self):
+        if self.lookup_team == 'Blue':
+            return f'{self.blue_score}-{self.red_score}'
+        else:
+            return f'{self.red_score}-{self.blue_score}'
+
+    def get_formatted_map(self):
+        formatted_map = []
+        start_date_timestamp = int(self.start_date.timestamp())
+        end_date_timestamp = int(self.end_date.timestamp())
+        formatted_map.append(f'**{self.map_name} | {self.get_score()} | <t:{start_date_timestamp}:d><t:{start_date_timestamp}:t> - <t:{end_date_timestamp}:d><t:{end_date_timestamp}:t>**')
+
+        # Sort players by team and KDA within each team
+        blue_team = [player for player in self.match_players if player.team_id == 'Blue']
+        red_team = [player for player in self.match_players if player.team_id == 'Red']
+
+        blue_team.sort(key=lambda x: x.score, reverse=True)
+        red_team.sort(key=lambda x: x.score, reverse=True)
+
+        rounds_played = self.get_rounds_played()
+        lookup_player = self.lookup_player.lower() if self.lookup_player != None else None
+        formatted_str = ""
+        for team in [blue_team, red_team]:
+            for player in team:
+                line = f'{get_team_emoji(player.team_id)}{player.get_agent_emoji()} | {player.get_full_tag()} | ACS: {player.score / rounds_played:.1f} | KDA: {player.get_kda_string()} | HS%: {player.get_headshot_percentage() * 100:.1f}%'
+                if player.get_full_tag().lower() == lookup_player:
+                    formatted_str += f'**{line}**\n'
+                else:
+                    formatted_str += f'{line}\n'
+
+        formatted_str += f'Server: {self.server}\n'
+        formatted_map.append(formatted_str)
+        return formatted_map
+
+# player stats of many matches stored column by column in numpy arrays (one row per player per match),
+# so analytics over the whole Match_Data collection don't need a python object per player
+class match_batch():
+    def __init__(self, match_ids: list, maps: list, servers: list, blue_score, red_score, winner, match_index, team, agent, kills, deaths, assists, score, headshots, bodyshots, legshots, agents: list):
+        # one entry per match
+        self.match_ids = match_ids
+        self.maps = maps
+        self.servers = servers
+        self.blue_score = blue_score
+        self.red_score = red_score
+        self.winner = winner
+        # one entry per player row, match_index points into the per match columns
+        self.match_index = match_index
+        self.team = team
+        self.agent = agent
+        self.kills = kills
+        self.deaths = deaths
+        self.assists = assists
+        self.score = score
+        self.headshots = headshots
+        self.bodyshots = bodyshots
+        self.legshots = legshots
+        # agent codes -> agent names
+        self.agents = agents
+
+    def __len__(self):
+        return len(self.match_index)
+
+    def get_match_count(self) -> int:
+        return len(self.match_ids)
+
+    def get_rounds_played(self):
+        return (self.blue_score + self.red_score)[self.match_index]
+
+    def get_agent_names(self):
+        return np.asarray(self.agents, dtype=object)[self.agent]
+
+    # same rules as match_player: with no deaths the ratio is the raw count
+    def get_kd(self):
+        return np.where(self.deaths != 0, self.kills / np.maximum(self.deaths, 1), self.kills)
+
+    def get_kda(self):
+        kills_and_assists = self.kills + self.assists
+        return np.where(self.deaths != 0, kills_and_assists / np.maximum(self.deaths, 1), kills_and_assists)
+
+    def get_headshot_percentage(self):
+        shots = self.headshots + self.bodyshots + self.legshots
+        return np.divide(self.headshots, shots, out=np.zeros(len(self), dtype=np.float64), where=shots != 0)
+
+    def get_acs(self):
+        rounds_played = self.get_rounds_played()
+        return np.divide(self.score, rounds_played, out=np.zeros(len(self), dtype=np.float64), where=rounds_played != 0)
+
+    def get_kills_per_round(self):
+        rounds_played = self.get_rounds_played()
+        return np.divide(self.kills, rounds_played, out=np.zeros(len(self), dtype=np.float64), where=rounds_played != 0)
+
+# build a match_batch from Match_Data documents in one pass, the documents can be a cursor
+def build_match_batch(documents) -> match_batch:
+    match_ids, maps, servers = [], [], []
+    blue_score, red_score, winner = array('i'), array('i'), array('b')
+    match_index, team, agent = array('i'), array('b'), array('h')
+    kills, deaths, assists, score = array('i'), array('i'), array('i'), array('i')
+    headshots, bodyshots, legshots = array('i'), array('i'), array('i')
+    agents = []
+    agent_codes = {}
+
+    for match_data in documents:
+        match_players = match_data.get('match_players')
+        if not match_players:
+            continue
+
+        current_match = len(match_ids)
+        match_ids.append(match_data['match_id'])
+        maps.append(match_data.get('map_name'))
+        servers.append(match_data.get('server'))
+        blue_score.append(to_int(match_data.get('blue_score')))
+        red_score.append(to_int(match_data.get('red_score')))
+        who_won = match_data.get('who_won')
+        winner.append(TEAMS.index(who_won) if who_won in TEAMS else -1)
+
+        for player_data in match_players:
+            agent_name = player_data['agent']
+            if agent_name not in agent_codes:
+                agent_codes[agent_name] = len(agents)
+                agents.append(agent_name)
+
+            match_index.append(current_match)
+            team.append(TEAMS.index(player_data['team_id']) if player_data['team_id'] in TEAMS else -1)
+            agent.append(agent_codes[agent_name])
+            kills.append(int(player_data['kills']))
+            deaths.append(int(player_data['deaths']))
+            assists.append(int(player_data['assists']))
+            score.append(int(player_data['score']))
+            headshots.append(int(player_data['headshots']))
+            bodyshots.append(int(player_data['bodyshots']))
+            legshots.append(int(player_data['legshots']))
+
+    def to_numpy(values, dtype):
+        return np.frombuffer(values, dtype=dtype).copy() if len(values) > 0 else np.zeros(0, dtype=dtype)
+
+    return match_batch(
+        match_ids, maps, servers,
+        to_numpy(blue_score, np.int32), to_numpy(red_score, np.int32), to_numpy(winner, np.int8),
+        to_numpy(match_index, np.int32), to_numpy(team, np.int8), to_numpy(agent, np.int16),
+        to_numpy(kills, np.int32), to_numpy(deaths, np.int32), to_numpy(assists, np.int32), to_numpy(score, np.int32),
+        to_numpy(headshots, np.int32), to_numpy(bodyshots, np.int32), to_numpy(legshots, np.int32),
+        agents
+    )
+
+# yield match_batches of at most batch_size matches, so a whole collection can be scanned in bounded memory
+def iter_match_batches(documents, batch_size: int = 10000):
+    chunk = []
+    for match_data in documents:
+        chunk.append(match_data)
+        if len(chunk) >= batch_size:
+            yield build_match_batch(chunk)
+            chunk = []
+    if chunk:
+        yield build_match_batch(chunk)
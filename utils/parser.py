@@ -0,0 +1,214 @@
+import json
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from utils.models import parse_ability_casts, to_int, RESULTS
+
+# msgspec decodes the raw response straight into typed structs and skips every field we don't store
+# (round by round data, kill events, ...), which is most of a v4 match payload.
+# without it we fall back to orjson or the standard json module and walk the dicts
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# bumped whenever the shape of a Match_Data document changes, migrate_match_data.py brings old documents up to date
+SCHEMA_VERSION = 1
+
+def parse_started_at(started_at: str) -> datetime:
+    # e.g. 2024-11-02T21:33:49.123Z, stored as a naive utc datetime
+    return datetime.fromisoformat(started_at[:-1] if started_at.endswith('Z') else started_at)
+
+def get_who_won(blue_won: bool, red_won: bool) -> str:
+    if red_won:
+        return 'Red'
+    if blue_won:
+        return 'Blue'
+    return 'Tie'
+
+# build the Match_Data document from the 'data' object of a v4 match payload, the only place
+# the document is built: decode_match feeds it the decoded structs as builtins
+def get_match_document(data: dict) -> dict:
+    metadata = data['metadata']
+    match_start_time = parse_started_at(metadata['started_at'])
+
+    blue_score, red_score = 0, 0
+    blue_won, red_won = False, False
+    for team_data in data['teams']:
+        if team_data['team_id'] == 'Red':
+            red_score = team_data['rounds']['won']
+            red_won = team_data['won'] == True
+        elif team_data['team_id'] == 'Blue':
+            blue_score = team_data['rounds']['won']
+            blue_won = team_data['won'] == True
+
+    match_players = []
+    for player_data in data['players']:
+        player_stats = player_data['stats']
+        ability_casts = player_data['ability_casts']
+        match_players.append({
+            "name": player_data['name'],
+            "tag": player_data['tag'],
+            "team_id": player_data['team_id'],
+            "agent": player_data['agent']['name'].lower(),
+            "kills": int(player_stats['kills']),
+            "deaths": int(player_stats['deaths']),
+            "score": int(player_stats['score']),
+            "assists": int(player_stats['assists']),
+            "headshots": int(player_stats['headshots']),
+            "bodyshots": int(player_stats['bodyshots']),
+            "legshots": int(player_stats['legshots']),
+            "ability_casts": {
+                "grenade": to_int(ability_casts['grenade']),
+                "ability1": to_int(ability_casts['ability1']),
+                "ability2": to_int(ability_casts['ability2']),
+                "ultimate": to_int(ability_casts['ultimate'])
+            },
+            "tier": player_data['tier']['name']
+        })
+
+    return {
+        "map_name": metadata['map']['name'],
+        "server": metadata['cluster'],
+        "match_id": metadata['match_id'],
+        "blue_score": int(blue_score),
+        "red_score": int(red_score),
+        "who_won": get_who_won(blue_won, red_won),
+        "match_players": match_players,
+        "start_date": match_start_time,
+        "end_date": match_start_time + timedelta(milliseconds=int(metadata['game_length_in_ms'])),
+        "schema_version": SCHEMA_VERSION
+    }
+
+PLAYER_STATS = ['kills', 'deaths', 'score', 'assists', 'headshots', 'bodyshots', 'legshots']
+ABILITY_CASTS = ['grenade', 'ability1', 'ability2', 'ultimate']
+
+# like to_int, but also takes the strings and NaNs older documents have
+def coerce_int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+# bring a stored Match_Data document to the current schema, returns (mongo update, set of what changed)
+def normalize_match_document(match_data: dict) -> tuple:
+    set_fields, unset_fields = {}, {}
+    changes = set()
+
+    for field in ['blue_score', 'red_score']:
+        if type(match_data.get(field)) != int:
+            set_fields[field] = coerce_int(match_data.get(field))
+            changes.add('scores')
+
+    # NaN from documents written through pandas, removed so backfill_matches.py picks the match up
+    who_won = match_data.get('who_won')
+    if who_won != None and who_won not in RESULTS:
+        unset_fields['who_won'] = ''
+        changes.add('who_won')
+
+    match_players = []
+    players_changed = False
+    for player_data in match_data.get('match_players') or []:
+        player_data = dict(player_data)
+        ability_casts = player_data.get('ability_casts')
+        if not isinstance(ability_casts, dict):
+            changes.add('ability_casts')
+        parsed_casts = parse_ability_casts(ability_casts) if ability_casts != None else {}
+        normalized_casts = {key: coerce_int(parsed_casts.get(key)) for key in ABILITY_CASTS}
+        if normalized_casts != ability_casts:
+            player_data['ability_casts'] = normalized_casts
+            players_changed = True
+            if isinstance(ability_casts, dict):
+                # None (the api sends null for unused abilities), missing or non int counts
+                changes.add('ability_cast_values')
+
+        for stat in PLAYER_STATS:
+            if type(player_data.get(stat)) != int:
+                player_data[stat] = coerce_int(player_data.get(stat))
+                changes.add('player_stats')
+                players_changed = True
+
+        agent = player_data.get('agent')
+        if isinstance(agent, str) and agent != agent.lower():
+            player_data['agent'] = agent.lower()
+            changes.add('agent')
+            players_changed = True
+        match_players.append(player_data)
+
+    if players_changed:
+        set_fields['match_players'] = match_players
+    set_fields['schema_version'] = SCHEMA_VERSION
+
+    update = {'$set': set_fields}
+    if unset_fields:
+        update['$unset'] = unset_fields
+    return update, changes
+
+def decode_match_json(raw: bytes) -> dict:
+    return get_match_document(loads(raw)['data'])
+
+if msgspec != None:
+    # both decoders have to accept the same payloads, so every field get_match_document stores as is
+    # (the api sends null for some of them) is Optional, only what it converts or calls into is required
+    class named_struct(msgspec.Struct):
+        name: Optional[str] = None
+
+    class stats_struct(msgspec.Struct):
+        kills: int
+        deaths: int
+        score: int
+        assists: int
+        headshots: int
+        bodyshots: int
+        legshots: int
+
+    class ability_casts_struct(msgspec.Struct):
+        grenade: Optional[int] = None
+        ability1: Optional[int] = None
+        ability2: Optional[int] = None
+        ultimate: Optional[int] = None
+
+    class player_struct(msgspec.Struct):
+        agent: named_struct
+        stats: stats_struct
+        ability_casts: ability_casts_struct
+        tier: named_struct
+        name: Optional[str] = None
+        tag: Optional[str] = None
+        team_id: Optional[str] = None
+
+    class rounds_struct(msgspec.Struct):
+        won: int
+
+    class team_struct(msgspec.Struct):
+        rounds: rounds_struct
+        team_id: Optional[str] = None
+        won: Optional[bool] = None
+
+    class metadata_struct(msgspec.Struct):
+        map: named_struct
+        started_at: str
+        game_length_in_ms: int
+        match_id: Optional[str] = None
+        cluster: Optional[str] = None
+
+    class match_struct(msgspec.Struct):
+        metadata: metadata_struct
+        players: List[player_struct]
+        teams: List[team_struct]
+
+    class match_response_struct(msgspec.Struct):
+        data: match_struct
+
+    match_decoder = msgspec.json.Decoder(match_response_struct)
+
+    def decode_match(raw: bytes) -> dict:
+        return get_match_document(msgspec.to_builtins(match_decoder.decode(raw).data))
+else:
+    decode_match = decode_match_json
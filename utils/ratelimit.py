@@ -0,0 +1,156 @@
+import asyncio
+import heapq
+import itertools
+import time
+import contextlib
+import multiprocessing
+
+# lower numbers are served first, so slash commands never wait behind background jobs
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# async token bucket shared by everything in the process that talks to one API.
+# callers queue up (by priority, then first come first served) instead of failing,
+# and the bucket is corrected from the rate limit headers the API sends back
+class rate_limiter():
+    def __init__(self, rate: int, per: float = 60, default_penalty: float = 60):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.default_penalty = default_penalty
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.waiters = []
+        self.counter = itertools.count()
+        self.dispatcher = None
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.fill_rate)
+        self.updated_at = now
+
+    def get_wait_time(self) -> float:
+        self.refill()
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.fill_rate
+
+    async def acquire(self, priority: int = INTERACTIVE):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self.dispatch())
+        await future
+
+    # hands tokens out to queued callers one at a time as they become available
+    async def dispatch(self):
+        while self.waiters:
+            # callers that gave up (e.g. the interaction timed out) don't get a token
+            if self.waiters[0][2].done():
+                heapq.heappop(self.waiters)
+                continue
+
+            wait_time = self.take()
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+                continue
+
+            _, _, future = heapq.heappop(self.waiters)
+            future.set_result(None)
+
+    # takes a token when one is available, otherwise returns how long until there is one
+    def take(self) -> float:
+        wait_time = self.get_wait_time()
+        if wait_time == 0:
+            self.tokens -= 1
+        return wait_time
+
+    # tokens in the bucket right now, for the metrics
+    def get_tokens(self) -> float:
+        self.refill()
+        return self.tokens
+
+    # take extra tokens for work that turned out to cost more than one request, the bucket can go into debt
+    def consume(self, count: float):
+        self.refill()
+        self.tokens -= count
+
+    # sync the bucket with what the API says about our quota
+    def update(self, status: int, response_headers):
+        now = time.monotonic()
+        remaining = response_headers.get('x-ratelimit-remaining')
+        reset = response_headers.get('x-ratelimit-reset')
+        retry_after = response_headers.get('Retry-After')
+
+        if status == 429:
+            penalty = self.default_penalty
+            for value in (retry_after, reset):
+                if value is not None:
+                    try:
+                        penalty = float(value)
+                        break
+                    except ValueError:
+                        pass
+            self.tokens = 0
+            self.blocked_until = max(self.blocked_until, now + penalty)
+            return
+
+        if remaining is not None:
+            try:
+                remaining = int(remaining)
+            except ValueError:
+                return
+            self.refill()
+            self.tokens = min(self.tokens, remaining)
+            if remaining <= 0 and reset is not None:
+                try:
+                    self.blocked_until = max(self.blocked_until, now + float(reset))
+                except ValueError:
+                    pass
+
+# positions of the bucket in the shared state
+TOKENS, UPDATED_AT, BLOCKED_UNTIL = range(3)
+
+# shared memory for a shared_rate_limiter, made by the launcher before it starts the processes
+def create_shared_state(context=multiprocessing):
+    return context.Array('d', 3)
+
+# one bucket for several processes on the same host (the clusters in main.py), so they all draw from one
+# API quota and a 429 seen by one backs all of them off. time.monotonic() is the same clock in every
+# process, so the refill math still works. queueing by priority stays per process
+class shared_rate_limiter(rate_limiter):
+    def __init__(self, state, rate: int, per: float = 60, default_penalty: float = 60):
+        super().__init__(rate, per, default_penalty)
+        self.state = state
+        # the first process to start fills the bucket
+        with state.get_lock():
+            if state[UPDATED_AT] == 0:
+                state[:] = [self.tokens, self.updated_at, self.blocked_until]
+
+    # runs a bucket operation on the shared state, holding the lock so no other process changes it meanwhile
+    @contextlib.contextmanager
+    def synced(self):
+        with self.state.get_lock():
+            self.tokens, self.updated_at, self.blocked_until = self.state[:]
+            yield
+            self.state[:] = [self.tokens, self.updated_at, self.blocked_until]
+
+    def take(self) -> float:
+        with self.synced():
+            return super().take()
+
+    # the shared budget, not this process' copy of it from its last sync
+    def get_tokens(self) -> float:
+        with self.synced():
+            return super().get_tokens()
+
+    def consume(self, count: float):
+        with self.synced():
+            super().consume(count)
+
+    def update(self, status: int, response_headers):
+        with self.synced():
+            super().update(status, response_headers)
@@ -0,0 +1,99 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from utils.ratelimit import rate_limiter, BACKGROUND
+
+# keeps recently and frequently looked up players warm in the background.
+# players sit in a heap ordered by when their next refresh is due (popular players first when
+# several are due), popular players are refreshed more often, and all refreshes share an API budget
+class refresh_scheduler():
+    def __init__(self, refresh, interval: float = 300, min_interval: float = 60, budget: int = 10, budget_period: float = 60, popularity_half_life: float = 3600, idle_after: float = 24 * 60 * 60, max_players: int = 5000):
+        # refresh(*args) does the work for one player and returns how many API calls it made
+        self.refresh = refresh
+        self.interval = interval
+        self.min_interval = min_interval
+        self.budget = rate_limiter(budget, per=budget_period)
+        self.popularity_half_life = popularity_half_life
+        self.idle_after = idle_after
+        self.max_players = max_players
+        self.players = {}
+        self.queue = []
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.refreshes = 0
+
+    def get_popularity(self, player: dict, now: float) -> float:
+        elapsed = now - player['last_queried']
+        return player['popularity'] * 0.5 ** (elapsed / self.popularity_half_life)
+
+    def get_refresh_interval(self, popularity: float) -> float:
+        return max(self.min_interval, self.interval / max(popularity, 1))
+
+    def schedule(self, key, due_at: float):
+        player = self.players[key]
+        player['due_at'] = due_at
+        heapq.heappush(self.queue, (due_at, -player['popularity'], next(self.counter), key))
+        self.wakeup.set()
+
+    # called every time a player is looked up
+    def track(self, key, *args):
+        now = time.time()
+        player = self.players.get(key)
+        if player == None:
+            if len(self.players) >= self.max_players:
+                oldest_key = min(self.players, key=lambda k: self.players[k]['last_queried'])
+                del self.players[oldest_key]
+            self.players[key] = {'args': args, 'popularity': 1.0, 'last_queried': now, 'due_at': None}
+            self.schedule(key, now + self.get_refresh_interval(1.0))
+            return
+
+        player['popularity'] = self.get_popularity(player, now) + 1
+        player['last_queried'] = now
+        player['args'] = args
+        due_at = now + self.get_refresh_interval(player['popularity'])
+        if due_at < player['due_at']:
+            self.schedule(key, due_at)
+
+    async def run(self):
+        while True:
+            if len(self.queue) == 0:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            due_at, _, _, key = self.queue[0]
+            now = time.time()
+            if due_at > now:
+                # sleep until the next refresh is due or an earlier one gets scheduled
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), due_at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.queue)
+            player = self.players.get(key)
+            # skip entries that were rescheduled or players that were dropped
+            if player == None or player['due_at'] != due_at:
+                continue
+            if now - player['last_queried'] > self.idle_after:
+                del self.players[key]
+                continue
+
+            await self.budget.acquire(BACKGROUND)
+            calls = 1
+            try:
+                calls = await self.refresh(*player['args'])
+                self.refreshes += 1
+            except Exception as e:
+                print(f'[Scheduler] could not refresh {key}: {e}')
+            self.budget.consume(max(calls - 1, 0))
+
+            if key in self.players:
+                self.schedule(key, time.time() + self.get_refresh_interval(self.get_popularity(player, time.time())))
+
+    def stats(self) -> dict:
+        return {'tracked_players': len(self.players), 'queued': len(self.queue), 'refreshes': self.refreshes}
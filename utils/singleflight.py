@@ -0,0 +1,33 @@
+import asyncio
+
+# coalesces concurrent calls for the same key so only one of them does the work,
+# everyone else awaits the same result
+class single_flight():
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self.calls[key] = future
+            future.add_done_callback(lambda done: self.forget(key, done))
+        # shielded so one caller giving up doesn't cancel the call for the others
+        return await asyncio.shield(future)
+
+    # for calls made at a priority (lower numbers first, see utils/ratelimit.py): a caller only shares a call
+    # running at its own or a higher priority, so a slash command never ends up waiting on a background
+    # refresh that is still queued behind other background work. func gets the priority from the caller's args
+    async def do_with_priority(self, key, priority: int, func, *args, **kwargs):
+        for running_priority in range(priority):
+            future = self.calls.get((key, running_priority))
+            if future is not None:
+                return await asyncio.shield(future)
+        return await self.do((key, priority), func, *args, **kwargs)
+
+    def forget(self, key, future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+
+    def __len__(self):
+        return len(self.calls)
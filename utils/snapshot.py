@@ -0,0 +1,228 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import timedelta
+
+from bson import ObjectId
+
+from utils.models import to_int
+
+# pyarrow is only needed by the snapshot export and the analytics that read it, not by the bot
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Match_Data exported to two parquet tables under one directory:
+#   matches/  one row per match
+#   players/  one row per player per match, with the match columns the analytics filter on
+# both are hive partitioned (map_name=Ascent/ or start_month=2024-11/) so readers only open the
+# partitions a filter needs. snapshot.json holds the watermark: the _id of the last exported
+# document, new documents get larger ObjectIds so each export only appends what was inserted since.
+# ObjectIds are made by the client before the write though, so a slow writer can commit a document
+# with a smaller _id after the watermark moved past it. each export therefore reads OVERLAP_SECONDS
+# of _ids behind the watermark again and skips the match ids it already exported (kept in the
+# watermark). a document committed more than OVERLAP_SECONDS after its _id was made (or written by a
+# client whose clock is off by more than that) is still missed until the next --full export.
+
+SNAPSHOT_FILE = 'snapshot.json'
+OVERLAP_SECONDS = 10 * 60
+PARTITION_COLUMNS = {'map': 'map_name', 'date': 'start_month'}
+
+def require_pyarrow():
+    if pa == None:
+        raise ImportError('pyarrow is required for parquet snapshots, install it with: pip install pyarrow')
+
+def get_match_schema():
+    return pa.schema([
+        ('match_id', pa.string()),
+        ('map_name', pa.string()),
+        ('server', pa.string()),
+        ('blue_score', pa.int32()),
+        ('red_score', pa.int32()),
+        ('rounds_played', pa.int32()),
+        ('who_won', pa.string()),
+        ('start_date', pa.timestamp('ms')),
+        ('end_date', pa.timestamp('ms')),
+        ('start_month', pa.string())
+    ])
+
+def get_player_schema():
+    return pa.schema([
+        ('match_id', pa.string()),
+        ('map_name', pa.string()),
+        ('server', pa.string()),
+        ('start_date', pa.timestamp('ms')),
+        ('start_month', pa.string()),
+        ('rounds_played', pa.int32()),
+        ('name', pa.string()),
+        ('tag', pa.string()),
+        ('team_id', pa.string()),
+        ('won', pa.bool_()),
+        ('agent', pa.string()),
+        ('tier', pa.string()),
+        ('kills', pa.int32()),
+        ('deaths', pa.int32()),
+        ('assists', pa.int32()),
+        ('score', pa.int32()),
+        ('headshots', pa.int32()),
+        ('bodyshots', pa.int32()),
+        ('legshots', pa.int32())
+    ])
+
+def load_watermark(path: str) -> dict:
+    try:
+        with open(os.path.join(path, SNAPSHOT_FILE), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+# written after every chunk through a temporary file, so a crash never leaves half a watermark
+def save_watermark(path: str, watermark: dict):
+    file_path = os.path.join(path, SNAPSHOT_FILE)
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(watermark, file)
+    os.replace(temp_path, file_path)
+
+# turn a chunk of Match_Data documents into the column lists of both tables
+def get_columns(documents: list) -> tuple:
+    match_columns = {name: [] for name in get_match_schema().names}
+    player_columns = {name: [] for name in get_player_schema().names}
+
+    for match_data in documents:
+        # skip the seed row and anything else that never got match data
+        if not match_data.get('match_id') or not match_data.get('match_players'):
+            continue
+
+        start_date = match_data.get('start_date')
+        start_month = start_date.strftime('%Y-%m') if start_date != None else None
+        blue_score = to_int(match_data.get('blue_score'))
+        red_score = to_int(match_data.get('red_score'))
+        who_won = match_data.get('who_won')
+
+        match_columns['match_id'].append(match_data['match_id'])
+        match_columns['map_name'].append(match_data.get('map_name'))
+        match_columns['server'].append(match_data.get('server'))
+        match_columns['blue_score'].append(blue_score)
+        match_columns['red_score'].append(red_score)
+        match_columns['rounds_played'].append(blue_score + red_score)
+        match_columns['who_won'].append(who_won)
+        match_columns['start_date'].append(start_date)
+        match_columns['end_date'].append(match_data.get('end_date'))
+        match_columns['start_month'].append(start_month)
+
+        for player_data in match_data['match_players']:
+            player_columns['match_id'].append(match_data['match_id'])
+            player_columns['map_name'].append(match_data.get('map_name'))
+            player_columns['server'].append(match_data.get('server'))
+            player_columns['start_date'].append(start_date)
+            player_columns['start_month'].append(start_month)
+            player_columns['rounds_played'].append(blue_score + red_score)
+            player_columns['name'].append(player_data.get('name'))
+            player_columns['tag'].append(player_data.get('tag'))
+            player_columns['team_id'].append(player_data.get('team_id'))
+            player_columns['won'].append(player_data.get('team_id') == who_won if who_won != None else None)
+            player_columns['agent'].append(player_data.get('agent'))
+            player_columns['tier'].append(player_data.get('tier'))
+            for stat in ['kills', 'deaths', 'assists', 'score', 'headshots', 'bodyshots', 'legshots']:
+                player_columns[stat].append(to_int(player_data.get(stat)))
+
+    return match_columns, player_columns
+
+def write_table(path: str, columns: dict, schema, partition_column: str, snapshot_id: str):
+    table = pa.Table.from_pydict(columns, schema=schema)
+    if table.num_rows == 0:
+        return
+    # a unique file name per chunk, so appending never overwrites files of earlier exports
+    pq.write_to_dataset(
+        table, path,
+        partition_cols=[partition_column],
+        basename_template=f'part-{snapshot_id}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore'
+    )
+
+# where the next export starts reading: OVERLAP_SECONDS before the last exported _id was made.
+# watermarks written before recent_match_ids existed resume right after the last _id instead
+def get_export_query(watermark: dict, overlap_seconds: float) -> dict:
+    if watermark['last_id'] == None:
+        return {}
+    last_id = ObjectId(watermark['last_id'])
+    if 'recent_match_ids' not in watermark:
+        return {'_id': {'$gt': last_id}}
+    return {'_id': {'$gte': ObjectId.from_datetime(last_id.generation_time - timedelta(seconds=overlap_seconds))}}
+
+# append every document inserted since the last export, returns (matches, players) written.
+# documents changed in place after they were exported (e.g. a repaired who_won) are only picked
+# up by a full export
+def export_snapshot(match_collection, path: str, partition_by: str = 'map', batch_size: int = 5000, full: bool = False, on_progress=None, overlap_seconds: float = OVERLAP_SECONDS) -> tuple:
+    require_pyarrow()
+    if partition_by not in PARTITION_COLUMNS:
+        raise ValueError(f'partition_by must be one of {list(PARTITION_COLUMNS)}, got {partition_by}')
+
+    if full and os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+
+    watermark = load_watermark(path)
+    if watermark == None:
+        watermark = {'last_id': None, 'partition_by': partition_by, 'matches': 0, 'players': 0, 'exported_at': None}
+    elif watermark['partition_by'] != partition_by:
+        raise ValueError(f'the snapshot at {path} is partitioned by {watermark["partition_by"]}, run a full export to change it')
+
+    query = get_export_query(watermark, overlap_seconds)
+    # match id -> when its _id was made, for the exported documents inside the overlap window
+    recent_match_ids = watermark.get('recent_match_ids', {})
+    cursor = match_collection.find(query, batch_size=batch_size).sort('_id', 1)
+
+    partition_column = PARTITION_COLUMNS[partition_by]
+    match_schema = get_match_schema()
+    player_schema = get_player_schema()
+    exported_matches, exported_players = 0, 0
+
+    def flush(chunk: list):
+        nonlocal exported_matches, exported_players
+        last_id = chunk[-1]['_id']
+        chunk = [match_data for match_data in chunk if match_data.get('match_id') not in recent_match_ids]
+        match_columns, player_columns = get_columns(chunk)
+        snapshot_id = uuid.uuid4().hex
+        write_table(os.path.join(path, 'matches'), match_columns, match_schema, partition_column, snapshot_id)
+        write_table(os.path.join(path, 'players'), player_columns, player_schema, partition_column, snapshot_id)
+
+        exported_matches += len(match_columns['match_id'])
+        exported_players += len(player_columns['match_id'])
+        for match_data in chunk:
+            if match_data.get('match_id'):
+                recent_match_ids[match_data['match_id']] = match_data['_id'].generation_time.timestamp()
+        oldest = last_id.generation_time.timestamp() - overlap_seconds
+        for match_id in [match_id for match_id, created_at in recent_match_ids.items() if created_at < oldest]:
+            del recent_match_ids[match_id]
+        watermark['recent_match_ids'] = recent_match_ids
+        watermark['last_id'] = str(last_id)
+        watermark['matches'] += len(match_columns['match_id'])
+        watermark['players'] += len(player_columns['match_id'])
+        watermark['exported_at'] = time.time()
+        save_watermark(path, watermark)
+        if on_progress != None:
+            on_progress(exported_matches, exported_players)
+
+    chunk = []
+    for match_data in cursor:
+        chunk.append(match_data)
+        if len(chunk) >= batch_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    return exported_matches, exported_players
+
+# read one table of a snapshot, filters use the pyarrow format (e.g. [('map_name', '=', 'Ascent')])
+# and are pushed down to skip whole partitions and row groups
+def read_snapshot_table(path: str, table: str, columns: list = None, filters: list = None):
+    require_pyarrow()
+    return pq.read_table(os.path.join(path, table), columns=columns, filters=filters, memory_map=True)
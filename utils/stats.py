@@ -0,0 +1,99 @@
+from pymongo import ASCENDING
+
+from utils.models import RESULTS
+
+# aggregation pipelines over matches.Match_Data that run inside mongo, so only the aggregated rows
+# are sent back instead of every match and its match_players. used by the stats slash commands
+# (through match_repository.aggregate) and by pyspark_test.py --summary (with plain pymongo)
+
+# indexes created by match_repository.setup. a $sort on the index prefix before the $group lets mongo
+# answer the map and server pipelines from the index alone. the agent pipeline unwinds match_players,
+# which an index can't cover, so it projects the two player fields it needs before unwinding
+STATS_INDEXES = [
+    [('map_name', ASCENDING), ('who_won', ASCENDING)],
+    [('server', ASCENDING), ('blue_score', ASCENDING), ('red_score', ASCENDING)]
+]
+
+def count_if(condition) -> dict:
+    return {'$sum': {'$cond': [condition, 1, 0]}}
+
+# kills per round for each agent: kill_ratio is total kills / total rounds, average_kill_ratio the
+# mean of each player's kills / rounds in a match
+def get_agent_kill_ratio_pipeline(map_name: str = None) -> list:
+    match = {'match_players.0': {'$exists': True}}
+    if map_name != None:
+        match['map_name'] = map_name
+
+    return [
+        {'$match': match},
+        {'$project': {
+            '_id': 0,
+            'rounds': {'$add': [{'$toInt': '$blue_score'}, {'$toInt': '$red_score'}]},
+            'match_players.agent': 1,
+            'match_players.kills': 1
+        }},
+        {'$match': {'rounds': {'$gt': 0}}},
+        {'$unwind': '$match_players'},
+        {'$group': {
+            '_id': '$match_players.agent',
+            'games': {'$sum': 1},
+            'kills': {'$sum': {'$toInt': '$match_players.kills'}},
+            'rounds': {'$sum': '$rounds'},
+            'average_kill_ratio': {'$avg': {'$divide': [{'$toInt': '$match_players.kills'}, '$rounds']}}
+        }},
+        {'$project': {
+            '_id': 0,
+            'agent': '$_id',
+            'games': 1,
+            'kills': 1,
+            'rounds': 1,
+            'kill_ratio': {'$divide': ['$kills', '$rounds']},
+            'average_kill_ratio': 1
+        }},
+        {'$sort': {'kill_ratio': -1}}
+    ]
+
+# how often each team wins on each map, matches saved before who_won existed are left out
+def get_map_win_rate_pipeline() -> list:
+    return [
+        {'$match': {'map_name': {'$type': 'string', '$ne': ''}, 'who_won': {'$in': RESULTS}}},
+        {'$sort': {'map_name': 1, 'who_won': 1}},
+        {'$group': {
+            '_id': '$map_name',
+            'games': {'$sum': 1},
+            'blue_wins': count_if({'$eq': ['$who_won', 'Blue']}),
+            'red_wins': count_if({'$eq': ['$who_won', 'Red']}),
+            'ties': count_if({'$eq': ['$who_won', 'Tie']})
+        }},
+        {'$project': {
+            '_id': 0,
+            'map_name': '$_id',
+            'games': 1,
+            'blue_wins': 1,
+            'red_wins': 1,
+            'ties': 1,
+            'blue_win_rate': {'$divide': ['$blue_wins', '$games']},
+            'red_win_rate': {'$divide': ['$red_wins', '$games']}
+        }},
+        {'$sort': {'games': -1}}
+    ]
+
+# matches and rounds played on each server
+def get_server_round_count_pipeline() -> list:
+    return [
+        {'$match': {'server': {'$type': 'string', '$ne': ''}}},
+        {'$sort': {'server': 1}},
+        {'$group': {
+            '_id': '$server',
+            'games': {'$sum': 1},
+            'rounds': {'$sum': {'$add': [{'$toInt': '$blue_score'}, {'$toInt': '$red_score'}]}}
+        }},
+        {'$project': {
+            '_id': 0,
+            'server': '$_id',
+            'games': 1,
+            'rounds': 1,
+            'average_rounds': {'$divide': ['$rounds', '$games']}
+        }},
+        {'$sort': {'rounds': -1}}
+    ]
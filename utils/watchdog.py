@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import Counter
+
+from utils import metrics
+from utils.metrics import metrics_registry
+
+# finds what blocks the event loop. a heartbeat task on the loop measures how late it wakes up (the lag),
+# and a thread watches the heartbeat: once it is more than threshold seconds late the thread grabs the
+# loop thread's stack, which is the code blocking it right now. every stall is logged with that stack
+# and the slash command running, and counted per call site (the innermost line of our own code)
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# our own frames that are never the blocking call site
+IGNORED_FILES = (os.path.abspath(__file__), os.path.abspath(metrics.__file__))
+
+def is_project_file(filename: str) -> bool:
+    return filename.startswith(PROJECT_ROOT) and 'site-packages' not in filename and filename not in IGNORED_FILES
+
+def get_call_site(frame) -> str:
+    innermost = None
+    while frame != None:
+        if innermost == None:
+            innermost = frame
+        if is_project_file(frame.f_code.co_filename):
+            return f'{os.path.relpath(frame.f_code.co_filename, PROJECT_ROOT)}:{frame.f_lineno} ({frame.f_code.co_name})'
+        frame = frame.f_back
+    if innermost == None:
+        return 'unknown'
+    return f'{innermost.f_code.co_filename}:{innermost.f_lineno} ({innermost.f_code.co_name})'
+
+# the slash command whose instrument_command wrapper is on the stack
+def get_command_name(frame) -> str:
+    while frame != None:
+        if frame.f_code.co_name == 'wrapper' and frame.f_code.co_filename == metrics.__file__:
+            func = frame.f_locals.get('func')
+            if func != None:
+                return func.__name__
+        frame = frame.f_back
+    return None
+
+class loop_watchdog():
+    def __init__(self, threshold: float = 0.25, interval: float = 0.05, stack_limit: int = 20, metrics: metrics_registry = None):
+        self.threshold = threshold
+        self.interval = interval
+        self.stack_limit = stack_limit
+        self.metrics = metrics if metrics != None else metrics_registry()
+        # (call site, command) -> number of stalls
+        self.stalls = Counter()
+        self.beat_at = time.monotonic()
+        self.stall = None
+        self.loop_thread_id = None
+        self.heartbeat_task = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        loop = loop or asyncio.get_event_loop()
+        self.heartbeat_task = loop.create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, daemon=True, name='loop-watchdog')
+        self.thread.start()
+        print(f'[Watchdog] reporting event loop stalls over {self.threshold * 1000:.0f}ms')
+
+    def stop(self):
+        self.stopped.set()
+        if self.heartbeat_task != None:
+            self.heartbeat_task.cancel()
+
+    async def heartbeat(self):
+        self.loop_thread_id = threading.get_ident()
+        while True:
+            beat_at = self.beat_at = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0, time.monotonic() - beat_at - self.interval)
+            self.metrics.observe('loop_lag_seconds', lag, buckets=LAG_BUCKETS)
+
+            stall = self.stall
+            self.stall = None
+            if stall != None and stall['beat_at'] != beat_at:
+                stall = None
+            if lag >= self.threshold:
+                # the watch thread may have missed a stall that ended right after the threshold
+                site, command = (stall['site'], stall['command']) if stall != None else ('unknown', None)
+                labels = {'site': site, 'command': command or 'none'}
+                self.stalls[(site, command)] += 1
+                self.metrics.inc('loop_stalls_total', labels)
+                self.metrics.observe('loop_stall_seconds', lag, {'command': command or 'none'}, buckets=LAG_BUCKETS)
+                if stall != None:
+                    print(f'[Watchdog] event loop unblocked after {lag * 1000:.0f}ms ({command or "no command"} at {site})')
+
+    def watch(self):
+        while not self.stopped.wait(self.interval / 2):
+            beat_at = self.beat_at
+            if self.loop_thread_id == None or time.monotonic() - beat_at < self.interval + self.threshold:
+                continue
+            if self.stall != None and self.stall['beat_at'] == beat_at:
+                continue
+
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame == None:
+                continue
+            site = get_call_site(frame)
+            command = get_command_name(frame)
+            stack = ''.join(traceback.format_stack(frame, limit=self.stack_limit))
+            self.stall = {'beat_at': beat_at, 'site': site, 'command': command}
+            print(f'[Watchdog] event loop blocked for over {self.threshold * 1000:.0f}ms during {command or "no command"} at {site}\n{stack}')
+
+    # call sites with the most stalls
+    def get_top_stalls(self, limit: int = 10) -> list:
+        return self.stalls.most_common(limit)